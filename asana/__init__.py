@@ -1,5 +1,9 @@
 from entities import *
+from entities.entity import EntityTable, IdentityMap, Query, Range
 from asana import *
+from sync import SyncState, SyncResult
+from store import SqliteTaskStore, TaskStore
+from layout import LayoutPlan
 
 import inspect
 
@@ -23,4 +27,4 @@ for cls in clsmembers:
 				cls[1]._children[key] = locals()[key[:-1].title()]
 
 
-Entity._matchons = matches
\ No newline at end of file
+Entity.set_matchons(matches)
\ No newline at end of file
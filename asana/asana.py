@@ -1,9 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import copy
+import math
+import random
 import requests
+import sys
+import threading
 import time
 
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 try:
     from urllib.parse import quote
 except ImportError:
@@ -14,8 +26,22 @@ try:
 except ImportError:
     import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:
+    ijson = None
+
 from pprint import pprint
 
+from db import SqliteConnection
+from pool import Future, WorkerPool, parallel_map
+
 
 class AsanaException(Exception):
     """Wrap api specific errors"""
@@ -27,28 +53,105 @@ class AsanaAPI(object):
     itself see: http://developer.asana.com/documentation/
     """
 
-    def __init__(self, apikey, debug=False, cache=None, dry_run=False):
+    def __init__(self, apikey, debug=False, cache=None, dry_run=False,
+                 pool_connections=10, pool_maxsize=10, pool_block=False,
+                 timeout=None, rate_limit=None, max_retries=5,
+                 retry_jitter=1.0, decoder=None, stream_pages=False):
         """Initializes the API
         :param apikey: the API from Asana
         :param debug: If true will print out requests
-        :param cache: If true will cache GET responses for the life of the script. If a number will only cache for that many seconds
+        :param cache: If true will cache GET responses for the life of the script. If a number will only cache for that many seconds. A Cache or other BaseCache instance, such as a persistent SqliteCache, can be passed instead
         :param dry_run: If true will prevent any POST, PUT or DELETE requests from executing
+        :param pool_connections: number of per-host connection pools to keep
+        :param pool_maxsize: maximum number of kept-alive connections per host
+        :param pool_block: if true, block when all pooled connections are in
+            use instead of opening throwaway connections
+        :param timeout: seconds to wait for the server, either a number or a
+            (connect, read) tuple. None waits forever
+        :param rate_limit: paces requests before they are sent. Either the
+            number of requests per minute or a RateLimiter, which can be shared
+            between APIs, threads and (with a path) processes
+        :param max_retries: how often a rate limited request is retried before
+            raising an AsanaException
+        :param retry_jitter: maximum random seconds added to each Retry-After
+        :param decoder: callable decoding a JSON response body from bytes.
+            Defaults to orjson if installed, otherwise simplejson or json
+        :param stream_pages: if true paginated requests are parsed
+            incrementally so results can be used before a whole page has
+            been parsed. Requires ijson
         """
         self.debug = debug
 
-        if cache:
+        if isinstance(cache, BaseCache):
+            self.cache = cache
+        elif cache:
             self.cache = Cache(cache)
         else:
             self.cache = False
 
         self.dry_run = dry_run
 
+        if isinstance(rate_limit, RateLimiter) or not rate_limit:
+            self.rate_limiter = rate_limit
+        else:
+            self.rate_limiter = RateLimiter(rate_limit)
+
+        self.max_retries = max_retries
+        self.retry_jitter = retry_jitter
+
+        self.decoder = decoder or (orjson.loads if orjson else json.loads)
+
+        if stream_pages and not ijson:
+            raise AsanaException('stream_pages requires the ijson module')
+
+        self.stream_pages = stream_pages
+
+        self._local = threading.local()
+        self._hooks = {'before': [], 'after': []}
+
+        #GETs being sent, by cache key, see _single_flight
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
         self.asana_url = "https://app.asana.com/api"
         self.api_version = "1.0"
         self.aurl = "/".join([self.asana_url, self.api_version])
         self.apikey = apikey
         self.bauth = self.get_basic_auth()
 
+        self.timeout = timeout
+        self.http_session = self._build_session(
+            pool_connections, pool_maxsize, pool_block)
+
+    def _build_session(self, pool_connections, pool_maxsize, pool_block):
+        """Builds the keep-alive session every request goes through so
+        connections (and their TLS handshakes) are reused between calls
+
+        :returns: a configured requests.Session
+        """
+        session = requests.Session()
+        session.auth = (self.apikey, "")
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        return session
+
+    def close(self):
+        """Closes all pooled connections. The API can still be used afterwards
+        but will have to open new connections"""
+        self.http_session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def get_basic_auth(self):
         """Get basic auth creds
         :returns: the basic auth string
@@ -72,42 +175,183 @@ class AsanaAPI(object):
             raise AsanaException('Received non 2xx or 404 status code on call')
 
     def _handle_rate_limit(self, r):
-        """ Sleep for length of retry time
+        """ Sleep for length of retry time plus a random jitter so parallel
+        workers don't all retry at the same moment. A shared rate limiter is
+        told to hold back every other caller for the same time
 
         :param r: request object
         """
         retry_time = int(r.headers['Retry-After'])
         assert(retry_time > 0)
+        retry_time += random.uniform(0, self.retry_jitter)
+
+        if self.rate_limiter:
+            self.rate_limiter.pause(retry_time)
+
         if self.debug:
-            print("-> Sleeping for %i seconds" % retry_time)
+            print("-> Sleeping for %.1f seconds" % retry_time)
         time.sleep(retry_time)
 
     def get(self, target, **kwargs):
-        """Peform a GET request
+        """Peform a GET request. Concurrent calls for the same target and
+        params share one request, with or without a cache
 
         :param target: API URI path for request
         """
 
         if self.cache:
-            if self.cache.has(target, **kwargs):
+            start = time.time()
+            ret = self.cache.lookup(target, **kwargs)
+
+            if ret is not BaseCache.MISS:
                 if self.debug:
                     print 'CACHE {0}'.format(target)
 
-                return self.cache.get(target, **kwargs)
+                event = self._new_event('get', target)
+                event['cache'] = 'hit'
+                self._emit('before', event)
 
-        ret = self._do_request('get', target, **kwargs)
+                event['latency'] = time.time() - start
 
-        if self.cache:
-            self.cache.store(ret, target, **kwargs)
+                self._emit('after', event)
+
+                return ret
+
+        return self._single_flight(target, **kwargs)
+
+    def _single_flight(self, target, **kwargs):
+        """Sends a GET, unless an identical one is already in flight on
+        another thread in which case its result is waited for. Waiting callers
+        each get their own copy, as entities keep and modify the dicts they
+        are built from. The response is cached before waiting callers are
+        released
+        """
+        key = BaseCache._get_key(target, **kwargs)
+
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            event = self._new_event('get', target)
+            event['cache'] = 'coalesced'
+            self._emit('before', event)
+
+            start = time.time()
+            try:
+                return copy.deepcopy(future.result())
+            except Exception as e:
+                event['error'] = e
+                raise
+            finally:
+                event['latency'] = time.time() - start
+                self._emit('after', event)
+
+        try:
+            ret = self._do_request('get', target, **kwargs)
+
+            if self.cache:
+                self.cache.store(ret, target, **kwargs)
+        except Exception:
+            future.set_exception(sys.exc_info())
+            raise
+        else:
+            future.set_result(ret)
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
 
         return ret
 
+    def get_pages(self, target, params=None, page_size=100):
+        """Lazily follows Asana's offset pagination, yielding one page (a list
+        of item dicts) per request. Pages are not cached. With stream_pages
+        each page is instead a generator yielding items while the response
+        is still being parsed
+
+        :param target: API URI path for request
+        :param params: query params to send with every page
+        :param page_size: number of items requested per page
+        """
+        params = dict(params or {})
+        params['limit'] = page_size
+
+        while True:
+            if self.stream_pages:
+                body = {}
+                page = self._do_request('get', target, params=dict(params),
+                                        stream_into=body)
+                yield page
+
+                #the rest of the envelope follows the data array
+                for _ in page:
+                    pass
+            else:
+                body = self._do_request('get', target, params=dict(params),
+                                        envelope=True)
+
+                if not body:
+                    return
+
+                yield body.get('data') or []
+
+            next_page = body.get('next_page')
+
+            if not next_page or not next_page.get('offset'):
+                return
+
+            params['offset'] = next_page['offset']
+
+    def cache_stats(self):
+        """
+        :returns: dict of cache hit, miss and eviction counters, empty if
+            caching is off
+        """
+        return self.cache.stats() if self.cache else {}
+
+    def batch(self, size=10):
+        """Queues the POST, PUT and DELETE requests made by this thread inside
+        the with block and submits them through the batch endpoint on exit.
+        While queued each request returns a Future resolving to its data
+
+        :param size: maximum number of actions per batch request, the API
+            allows at most 10
+        """
+        return Batch(self, size)
+
+    def session(self, max_workers=8, batch=False):
+        """Collects the PUT requests made by this thread inside the with
+        block, merging those to the same target, and sends them on exit. While
+        collected each request returns a Future resolving to its data
+
+            with api.session() as s:
+                for task in tasks:
+                    task.completed = True
+                    task.save()
+
+            print s.succeeded, s.failed
+
+        :param max_workers: number of requests sent at once
+        :param batch: send through the batch endpoint instead
+        """
+        return UnitOfWork(self, max_workers, batch)
+
     def delete(self, target, **kwargs):
         """Peform a DELETE request
 
         :param target: API URI path for request
         """
-        return self._do_request('delete', target, **kwargs)
+        batch = self._active_batch()
+        if batch:
+            return batch.add('delete', target, **kwargs)
+
+        ret = self._do_request('delete', target, **kwargs)
+        self._invalidate_cache(target)
+
+        return ret
 
     def post(self, target, **kwargs):
         """Peform a POST request
@@ -117,10 +361,17 @@ class AsanaAPI(object):
         :param files: Optional file to upload
         """
 
+        batch = self._active_batch()
+        if batch and 'files' not in kwargs:
+            return batch.add('post', target, **kwargs)
+
         if 'data' in kwargs:
             kwargs['data'] = json.dumps({'data':kwargs['data']})
 
-        return self._do_request('post', target, **kwargs)
+        ret = self._do_request('post', target, **kwargs)
+        self._invalidate_cache(target)
+
+        return ret
 
     def put(self, target, **kwargs):
         """Peform a PUT request
@@ -129,13 +380,64 @@ class AsanaAPI(object):
         :param data: PUT payload
         """
 
+        session = self._active_session()
+        if session:
+            return session.add(target, **kwargs)
+
+        batch = self._active_batch()
+        if batch:
+            return batch.add('put', target, **kwargs)
+
         if 'data' in kwargs:
             kwargs['data'] = json.dumps({'data':kwargs['data']})
-            
-        return self._do_request('put', target, **kwargs)
 
-    def _do_request(self, method, target, **kwargs):
+        ret = self._do_request('put', target, **kwargs)
+        self._invalidate_cache(target, ret)
+
+        return ret
+
+    def _active_batch(self):
+        return getattr(self._local, 'batch', None)
+
+    def _active_session(self):
+        return getattr(self._local, 'session', None)
 
+    def _invalidate_cache(self, target, item=None):
+        """Drops cached responses a mutation of target may have changed: the
+        item itself with everything below it (e.g. tasks/1 and tasks/1/tags)
+        and every collection of the same type (e.g. tasks and
+        projects/2/tasks)
+
+        :param target: API URI path that was mutated
+        :param item: the updated item returned by the API, if target is an
+            item url it is stored in place of the dropped response
+        """
+        if not self.cache or self.dry_run:
+            return
+
+        parts = target.strip('/').split('/')
+
+        self.cache.invalidate_collections(parts[0])
+
+        if len(parts) > 1:
+            self.cache.invalidate('/'.join(parts[:2]))
+
+            if item and len(parts) == 2:
+                self.cache.store(item, target)
+
+    def _do_request(self, method, target, envelope=False, stream_into=None,
+                    **kwargs):
+        """Performs the request
+
+        :param envelope: if true return the whole response body instead of
+            only its data member
+        :param stream_into: if a dict is given the response is parsed
+            incrementally; a generator of the data items is returned and
+            the other members of the body are stored in the dict as they
+            are parsed
+        """
+
+        path = target
         target = "/".join([self.aurl, target])
 
         if self.debug:
@@ -147,21 +449,159 @@ class AsanaAPI(object):
         if self.dry_run and method != 'get':
             return {}
 
-        r = getattr(requests, method)(target, auth=(self.apikey, ""), **kwargs)
-        if self._ok_status(r.status_code) and r.status_code is not 404:
-            if r.headers['content-type'].split(';')[0] == 'application/json':
-                if hasattr(r, 'text'):
-                    return json.loads(r.text)['data']
-                elif hasattr(r, 'content'):
-                    return json.loads(r.content)['data']
-                else:
-                    raise AsanaException('Unknown format in response from api')
-            else:
-                raise AsanaException(
-                    'Did not receive json from api: %s' % str(r))
+        kwargs.setdefault('timeout', self.timeout)
+
+        if stream_into is not None:
+            kwargs['stream'] = True
+
+        event = self._new_event(method, path)
+        if method == 'get' and self.cache and not envelope and stream_into is None:
+            event['cache'] = 'miss'
+
+        self._emit('before', event)
+        start = time.time()
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                event['retries'] = attempt
+
+                if self.rate_limiter:
+                    event['rate_limit_sleep'] += self.rate_limiter.acquire()
+
+                r = self.http_session.request(method, target, **kwargs)
+                event['status'] = r.status_code
+
+                if self._ok_status(r.status_code) and r.status_code is not 404:
+                    if stream_into is not None:
+                        event['bytes'] = int(r.headers.get('content-length', 0))
+                        return self._iter_stream(r, stream_into)
+
+                    event['bytes'] = len(r.content or '')
+                    return self._parse_response(r, envelope)
+
+                #out of retries, don't wait on a Retry-After nobody will honour
+                if r.status_code == 429 and attempt == self.max_retries:
+                    break
+
+                waited = time.time()
+                self.handle_exception(r)
+                event['rate_limit_sleep'] += time.time() - waited
+
+            raise AsanaException(
+                'Still rate limited after %i retries' % self.max_retries)
+        except Exception as e:
+            event['error'] = e
+            raise
+        finally:
+            event['latency'] = time.time() - start
+            self._emit('after', event)
+
+    def add_hook(self, when, fn):
+        """Registers a callback receiving an event dict for every request,
+        including GETs answered from the cache. Events have the keys: method,
+        target, endpoint (target with ids replaced by {id}), status, latency
+        (seconds), bytes, cache ('hit', 'miss', 'coalesced' when it waited on
+        an identical request from another thread or None when not cacheable),
+        retries, rate_limit_sleep (seconds) and error. Hooks are called on
+        the requesting thread and shouldn't raise
+
+        :param when: 'before' or 'after' the request. Only the method,
+            target and endpoint are set before
+        :param fn: callable taking the event, e.g. a RequestStats
+        """
+        if when not in self._hooks:
+            raise AsanaException('Unknown hook %s' % when)
+
+        self._hooks[when].append(fn)
+
+    def remove_hook(self, when, fn):
+        self._hooks[when].remove(fn)
+
+    def _emit(self, when, event):
+        for fn in self._hooks[when]:
+            fn(event)
+
+    @staticmethod
+    def _new_event(method, target):
+        return {
+            'method': method,
+            'target': target,
+            'endpoint': '/'.join(
+                '{id}' if part.isdigit() or part == 'me' else part
+                for part in target.strip('/').split('/')),
+            'status': None,
+            'latency': 0.0,
+            'bytes': 0,
+            'cache': None,
+            'retries': 0,
+            'rate_limit_sleep': 0.0,
+            'error': None
+        }
+
+    def _parse_response(self, r, envelope=False):
+        """Decodes a successful response
+
+        :param r: request object
+        :param envelope: if true return the whole response body instead of
+            only its data member
+        """
+        self._check_json(r)
+
+        if hasattr(r, 'content'):
+            body = self.decoder(r.content)
+        elif hasattr(r, 'text'):
+            body = self.decoder(r.text)
         else:
-            if (self.handle_exception(r) > 0):
-                return self._do_request(method, target, **kwargs)
+            raise AsanaException('Unknown format in response from api')
+
+        return body if envelope else body['data']
+
+    def _iter_stream(self, r, envelope):
+        """Incrementally parses a streamed response, yielding the items of its
+        data array as soon as each is complete
+
+        :param r: request object, requested with stream=True
+        :param envelope: dict the other top level members are stored in
+        """
+        self._check_json(r)
+
+        if hasattr(r.raw, 'decode_content'):
+            r.raw.decode_content = True
+
+        builder = None
+        building = None
+
+        try:
+            for prefix, event, value in ijson.parse(r.raw):
+                if builder is not None:
+                    builder.event(event, value)
+
+                    if prefix == building and event in ('end_map', 'end_array'):
+                        if building == 'data.item':
+                            yield builder.value
+                        else:
+                            envelope[building] = builder.value
+
+                        builder = None
+                elif prefix == 'data.item' or (
+                    prefix and prefix != 'data' and '.' not in prefix
+                ):
+                    if event in ('start_map', 'start_array'):
+                        builder = ObjectBuilder()
+                        builder.event(event, value)
+                        building = prefix
+                    elif prefix == 'data.item':
+                        yield value
+                    else:
+                        envelope[prefix] = value
+        finally:
+            r.close()
+
+    @staticmethod
+    def _check_json(r):
+        if r.headers['content-type'].split(';')[0] != 'application/json':
+            raise AsanaException(
+                'Did not receive json from api: %s' % str(r))
 
     @staticmethod
     def _ok_status(status_code):
@@ -177,39 +617,564 @@ class AsanaAPI(object):
         elif status_code is 500:
             return False
 
-class Cache(object):
-    def __init__(self, cachetime):
-        if isinstance(cachetime, int):
+class Batch(object):
+    """Requests queued by AsanaAPI.batch(). Actions are grouped into batch
+    requests of at most size actions which are sent in the order queued. The
+    API may run the actions within one group in parallel, so call barrier()
+    between actions that depend on each other
+    """
+
+    def __init__(self, api, size=10):
+        self.api = api
+        self.size = size
+        self._groups = [[]]
+
+    def add(self, method, target, data=None, params=None, **kwargs):
+        """Queues an action
+
+        :returns: a Future resolving to the action's data
+        """
+        action = {'method': method, 'relative_path': '/' + target}
+
+        if data is not None:
+            action['data'] = data
+        if params:
+            action['options'] = params
+
+        future = Future()
+        group = self._groups[-1]
+
+        if len(group) >= self.size:
+            group = []
+            self._groups.append(group)
+
+        group.append((action, future))
+
+        return future
+
+    def barrier(self):
+        """Makes the actions queued after this run after those queued before"""
+        if self._groups[-1]:
+            self._groups.append([])
+
+    def flush(self):
+        """Submits all queued actions, resolving their futures. A failed
+        group fails its actions' futures and the remaining groups are still
+        sent"""
+        groups, self._groups = self._groups, [[]]
+
+        for group in groups:
+            if not group:
+                continue
+
+            try:
+                responses = self.api._do_request(
+                    'post', 'batch',
+                    data=json.dumps({'data': {'actions': [a for a, _ in group]}}))
+            except Exception:
+                for _, future in group:
+                    future.set_exception(sys.exc_info())
+                continue
+
+            for idx, (action, future) in enumerate(group):
+                self._resolve(action, future, (responses or [])[idx:idx + 1])
+
+    def _resolve(self, action, future, response):
+        if self.api.dry_run:
+            future.set_result({})
+            return
+
+        if not response:
+            future.set_exception(self._exc_info(
+                'No response for batched {0} {1}'.format(
+                    action['method'].upper(), action['relative_path'])))
+            return
+
+        response = response[0]
+
+        if response.get('status_code', 0) // 100 != 2:
+            future.set_exception(self._exc_info(
+                'Batched {0} {1} failed with status {2}'.format(
+                    action['method'].upper(), action['relative_path'],
+                    response.get('status_code'))))
+            return
+
+        data = (response.get('body') or {}).get('data')
+        target = action['relative_path'][1:]
+
+        self.api._invalidate_cache(
+            target, data if action['method'] == 'put' else None)
+
+        future.set_result(data)
+
+    @staticmethod
+    def _exc_info(message):
+        try:
+            raise AsanaException(message)
+        except AsanaException:
+            return sys.exc_info()
+
+    def __enter__(self):
+        if self.api._active_batch():
+            raise AsanaException('A batch is already active in this thread')
+
+        self.api._local.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.api._local.batch = None
+
+        if exc_type is None:
+            self.flush()
+        else:
+            for group in self._groups:
+                for _, future in group:
+                    future.set_exception(
+                        (exc_type, exc_value, traceback))
+
+
+class UnitOfWork(object):
+    """Updates collected by AsanaAPI.session(). Updates to the same target
+    are merged into one request, later values winning, and every target is
+    sent once on flush, either concurrently or through the batch endpoint.
+    Targets end up in succeeded or, with the exception raised, in failed
+    """
+
+    def __init__(self, api, max_workers=8, batch=False):
+        self.api = api
+        self.max_workers = max_workers
+        self.batch = batch
+        self.succeeded = []
+        self.failed = {}
+        self._pending = OrderedDict()
+
+    def add(self, target, data=None, **kwargs):
+        """Queues an update of target
+
+        :returns: a Future resolving to the updated data
+        """
+        if target not in self._pending:
+            self._pending[target] = ({}, [])
+
+        update, futures = self._pending[target]
+        update.update(data or {})
+
+        future = Future()
+        futures.append(future)
+
+        return future
+
+    def flush(self):
+        """Sends every queued update, resolving their futures"""
+        pending, self._pending = list(self._pending.items()), OrderedDict()
+
+        #the updates themselves must not be queued again
+        active, self.api._local.session = self.api._active_session(), None
+
+        try:
+            if self.batch:
+                with self.api.batch():
+                    sent = [self.api.put(target, data=data) for target, (data, _) in pending]
+
+                outcomes = []
+
+                for future in sent:
+                    error = future.exception()
+                    outcomes.append(
+                        (None, (type(error), error, None)) if error else (future.result(), None))
+            else:
+                outcomes = parallel_map(self._send, pending, self.max_workers)
+        finally:
+            self.api._local.session = active
+
+        for (target, (_, futures)), (result, exc_info) in zip(pending, outcomes):
+            if exc_info:
+                self.failed[target] = exc_info[1]
+            else:
+                self.succeeded.append(target)
+
+            for future in futures:
+                if exc_info:
+                    future.set_exception(exc_info)
+                else:
+                    future.set_result(result)
+
+    def _send(self, item):
+        """
+        :returns: tuple of the result and None, or None and the exc_info
+        """
+        target, (data, _) = item
+
+        try:
+            return self.api.put(target, data=data), None
+        except Exception:
+            return None, sys.exc_info()
+
+    def __enter__(self):
+        if self.api._active_session():
+            raise AsanaException('A session is already active in this thread')
+
+        self.api._local.session = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.api._local.session = None
+
+        if exc_type is None:
+            self.flush()
+        else:
+            for _, futures in self._pending.values():
+                for future in futures:
+                    future.set_exception((exc_type, exc_value, traceback))
+
+
+class RateLimiter(object):
+    """Token bucket pacing requests before they are sent. Tokens refill
+    continuously at the given rate up to burst, and every request takes one,
+    waiting if none are available.
+
+    By default the bucket lives in memory and is shared by every thread using
+    it. Given a path the bucket state is kept in that file under an exclusive
+    lock so that all processes pointing to the same file share one budget
+    """
+
+    def __init__(self, per_minute, burst=None, path=None):
+        """
+        :param per_minute: sustained number of requests allowed per minute
+        :param burst: maximum number of requests that can be sent back to back,
+            defaults to per_minute
+        :param path: optional file to share the bucket between processes
+        """
+        if path and not fcntl:
+            raise AsanaException('Sharing a rate limiter between processes '
+                                 'is not supported on this platform')
+
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or per_minute)
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = time.time()
+
+    def acquire(self):
+        """Takes a token, sleeping until one is available
+
+        :returns: the number of seconds slept
+        """
+        slept = 0
+
+        while True:
+            wait = self._update(take=True)
+
+            if wait <= 0:
+                return slept
+
+            time.sleep(wait)
+            slept += wait
+
+    def pause(self, seconds):
+        """Empties the bucket and holds back all callers for seconds, used when
+        the server reports the limit was hit regardless"""
+        self._update(pause=seconds)
+
+    def _update(self, take=False, pause=0):
+        """Refills and optionally takes from or pauses the bucket
+
+        :returns: seconds to wait before a token is available, 0 if one was
+            taken
+        """
+        with self._lock:
+            if not self.path:
+                tokens, updated = self._tokens, self._updated
+                wait, self._tokens, self._updated = self._apply(
+                    tokens, updated, take, pause)
+                return wait
+
+            with open(self.path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    state = f.read().split()
+
+                    if len(state) == 2:
+                        tokens, updated = float(state[0]), float(state[1])
+                    else:
+                        tokens, updated = self.capacity, time.time()
+
+                    wait, tokens, updated = self._apply(
+                        tokens, updated, take, pause)
+
+                    f.seek(0)
+                    f.truncate()
+                    f.write('%r %r' % (tokens, updated))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+            return wait
+
+    def _apply(self, tokens, updated, take, pause):
+        """Computes the new bucket state. updated may lie in the future while
+        the bucket is paused
+
+        :returns: tuple of (wait, tokens, updated)
+        """
+        now = time.time()
+
+        if pause:
+            return 0, 0.0, max(updated, now + pause)
+
+        if updated > now:
+            return (updated - now) + (1 - tokens) / self.rate, tokens, updated
+
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+
+        if not take:
+            return 0, tokens, now
+
+        if tokens >= 1:
+            return 0, tokens - 1, now
+
+        return (1 - tokens) / self.rate, tokens, now
+
+
+class AsyncAsanaAPI(AsanaAPI):
+    """AsanaAPI which can also run requests in the background. Python 2 has
+    no event loop to await on, so instead of coroutines the asynchronous
+    calls return a Future from a pool of worker threads; any rate limit
+    sleeping happens on those threads rather than the caller's. The blocking
+    get/post/put/delete stay available so entities work unchanged
+    """
+
+    def __init__(self, apikey, max_workers=10, **kwargs):
+        """Initializes the API
+        :param max_workers: number of requests that can be in flight at once
+        Other params are passed through to AsanaAPI. The connection pool is
+        sized to max_workers unless pool_maxsize is given
+        """
+        kwargs.setdefault('pool_maxsize', max_workers)
+
+        super(AsyncAsanaAPI, self).__init__(apikey, **kwargs)
+
+        self.pool = WorkerPool(max_workers)
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs any callable on the worker pool
+
+        :returns: a Future for its result
+        """
+        return self.pool.submit(fn, *args, **kwargs)
+
+    def aget(self, target, **kwargs):
+        """Asynchronous get(), returning a Future"""
+        return self.submit(self.get, target, **kwargs)
+
+    def adelete(self, target, **kwargs):
+        """Asynchronous delete(), returning a Future"""
+        return self.submit(self.delete, target, **kwargs)
+
+    def apost(self, target, **kwargs):
+        """Asynchronous post(), returning a Future"""
+        return self.submit(self.post, target, **kwargs)
+
+    def aput(self, target, **kwargs):
+        """Asynchronous put(), returning a Future"""
+        return self.submit(self.put, target, **kwargs)
+
+    def close(self):
+        """Waits for queued requests then closes all pooled connections"""
+        self.pool.shutdown()
+        super(AsyncAsanaAPI, self).close()
+
+
+class RequestStats(object):
+    """Aggregates request events per method and endpoint. Register it as an
+    'after' hook:
+
+        stats = RequestStats()
+        api.add_hook('after', stats)
+        ...
+        stats.dump()
+    """
+
+    def __init__(self, max_samples=10000):
+        """
+        :param max_samples: latencies kept per endpoint for percentiles, a
+            random sample is kept once there are more
+        """
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __call__(self, event):
+        key = (event['method'].upper(), event['endpoint'])
+
+        with self._lock:
+            stats = self._stats.get(key)
+
+            if stats is None:
+                stats = self._stats[key] = {
+                    'count': 0, 'errors': 0, 'cache_hits': 0, 'coalesced': 0, 'retries': 0,
+                    'rate_limit_sleep': 0.0, 'bytes': 0, 'latencies': []
+                }
+
+            stats['count'] += 1
+            stats['errors'] += 1 if event['error'] else 0
+            stats['cache_hits'] += 1 if event['cache'] == 'hit' else 0
+            stats['coalesced'] += 1 if event['cache'] == 'coalesced' else 0
+            stats['retries'] += event['retries']
+            stats['rate_limit_sleep'] += event['rate_limit_sleep']
+            stats['bytes'] += event['bytes']
+
+            latencies = stats['latencies']
+
+            if len(latencies) < self.max_samples:
+                latencies.append(event['latency'])
+            else:
+                idx = random.randint(0, stats['count'] - 1)
+                if idx < self.max_samples:
+                    latencies[idx] = event['latency']
+
+    def report(self):
+        """
+        :returns: list of dicts per method and endpoint, most called first,
+            with counters and p50/p95/p99 latencies in seconds
+        """
+        with self._lock:
+            items = [(key, dict(stats, latencies=sorted(stats['latencies'])))
+                     for key, stats in self._stats.items()]
+
+        ret = []
+
+        for (method, endpoint), stats in items:
+            latencies = stats.pop('latencies')
+            stats.update(
+                method=method,
+                endpoint=endpoint,
+                p50=self._percentile(latencies, 50),
+                p95=self._percentile(latencies, 95),
+                p99=self._percentile(latencies, 99))
+            ret.append(stats)
+
+        return sorted(ret, key=lambda s: -s['count'])
+
+    def dump(self, out=None):
+        """Writes the report as a table, to stdout by default"""
+        out = out or sys.stdout
+        row = '{0:<7} {1:<40} {2:>7} {3:>6} {4:>6} {5:>9} {6:>9} {7:>9}\n'
+
+        out.write(row.format('METHOD', 'ENDPOINT', 'CALLS', 'ERRORS', 'CACHED',
+                             'P50 MS', 'P95 MS', 'P99 MS'))
+
+        for stats in self.report():
+            out.write(row.format(
+                stats['method'], stats['endpoint'], stats['count'],
+                stats['errors'], stats['cache_hits'],
+                '%.1f' % (stats['p50'] * 1000), '%.1f' % (stats['p95'] * 1000),
+                '%.1f' % (stats['p99'] * 1000)))
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    @staticmethod
+    def _percentile(values, percent):
+        """Nearest-rank percentile of sorted values"""
+        if not values:
+            return 0.0
+
+        rank = int(math.ceil(percent / 100.0 * len(values)))
+
+        return values[max(rank, 1) - 1]
+
+
+class BaseCache(object):
+    """Interface for caches of GET responses. Responses are keyed by their
+    target and params; each resource type (the users in users/me or the tasks
+    in projects/2/tasks) can have its own time to live
+    """
+
+    #returned by lookup() when there is no valid response
+    MISS = object()
+
+    def __init__(self, cachetime=0, ttls=None):
+        """
+        :param cachetime: default seconds entries stay valid, 0 or True for
+            forever
+        :param ttls: dict of resource type to seconds overriding cachetime,
+            e.g. {'users': 86400, 'tasks': 60}
+        """
+        if isinstance(cachetime, int) and not isinstance(cachetime, bool):
             self.cachetime = cachetime
         else:
             self.cachetime = 0 #forever!
 
-        self._cache = {}
+        self.ttls = ttls or {}
 
-    def has(self, target, **kwargs):
-        key = self._get_key(target, **kwargs)
-        item = self._cache.get(key)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
 
-        if item:
-            if not self.cachetime:
-                return True
+    def lookup(self, target, **kwargs):
+        """Returns the cached response in one step, counting the hit or miss.
+        Subclasses should override this, the default checks has() then reads
+        with get() so another thread or process can remove the entry between
+        the two
 
-            if time.time() - self.cachetime <= item['createTime']:
-                return True
-            else:
-                del self._cache[key]
+        :returns: the response or MISS
+        """
+        if not self.has(target, **kwargs):
+            return self.MISS
 
-        return False
+        return self.get(target, **kwargs)
+
+    def has(self, target, **kwargs):
+        raise NotImplementedError
 
     def get(self, target, **kwargs):
-        return self._cache.get(self._get_key(target, **kwargs))['value']
+        raise NotImplementedError
 
     def store(self, value, target, **kwargs):
-        self._cache[self._get_key(target, **kwargs)] = {
-            'value': value,
-            'createTime': time.time()
+        raise NotImplementedError
+
+    def invalidate(self, target):
+        """Removes the responses for target and any path below it"""
+        raise NotImplementedError
+
+    def invalidate_collections(self, resource):
+        """Removes the responses for every collection of a resource type, i.e.
+        every path ending in resource"""
+        raise NotImplementedError
+
+    def sweep(self):
+        """Removes all expired entries"""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        :returns: dict of counters and current usage
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations
         }
 
+    def _ttl_for(self, target):
+        """
+        :returns: seconds responses for target stay valid, 0 for forever
+        """
+        parts = target.strip('/').split('/')
+        resource = parts[-2] if len(parts) % 2 == 0 else parts[-1]
+
+        return self.ttls.get(resource, self.cachetime)
+
     @staticmethod
     def _get_key(target, **kwargs):
         key = target
@@ -217,4 +1182,236 @@ class Cache(object):
         if kwargs.get('params'):
             key += str(kwargs['params'])
 
-        return key
\ No newline at end of file
+        return key
+
+
+class Cache(BaseCache):
+    """In memory cache of GET responses with optional expiry, entry and size
+    limits. The least recently used entries are evicted first once a limit is
+    reached, and expired entries are swept every sweep_interval stores so keys
+    that are never queried again don't linger. Responses are copied going in
+    and out as entities modify the dicts they are built from
+    """
+
+    def __init__(self, cachetime=0, max_entries=None, max_bytes=None,
+                 sweep_interval=100, ttls=None):
+        """
+        :param cachetime: seconds entries stay valid, 0 or True for forever
+        :param max_entries: maximum number of responses kept
+        :param max_bytes: maximum total size of the kept responses, measured
+            as their JSON encoded length
+        :param sweep_interval: number of stores between expiry sweeps
+        :param ttls: see BaseCache
+        """
+        super(Cache, self).__init__(cachetime, ttls)
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._bytes = 0
+        self._stores = 0
+
+    def lookup(self, target, **kwargs):
+        key = self._get_key(target, **kwargs)
+
+        with self._lock:
+            item = self._cache.get(key)
+
+            if item:
+                if not self._expired(item):
+                    #re-insert to mark as most recently used
+                    del self._cache[key]
+                    self._cache[key] = item
+                    self.hits += 1
+                    return copy.deepcopy(item['value'])
+
+                self._remove(key)
+                self.expirations += 1
+
+            self.misses += 1
+
+        return self.MISS
+
+    def has(self, target, **kwargs):
+        return self.lookup(target, **kwargs) is not self.MISS
+
+    def get(self, target, **kwargs):
+        with self._lock:
+            item = self._cache.get(self._get_key(target, **kwargs))
+
+        return copy.deepcopy(item['value']) if item else None
+
+    def store(self, value, target, **kwargs):
+        key = self._get_key(target, **kwargs)
+        value = copy.deepcopy(value)
+        size = len(json.dumps(value)) if self.max_bytes else 0
+
+        with self._lock:
+            if key in self._cache:
+                self._remove(key)
+
+            self._cache[key] = {
+                'target': target,
+                'value': value,
+                'createTime': time.time(),
+                'size': size
+            }
+            self._bytes += size
+
+            self._stores += 1
+            if self._stores % self.sweep_interval == 0:
+                self.sweep()
+
+            while self._cache and (
+                (self.max_entries and len(self._cache) > self.max_entries) or
+                (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._cache)))
+                self.evictions += 1
+
+    def sweep(self):
+        with self._lock:
+            for key, item in list(self._cache.items()):
+                if self._expired(item):
+                    self._remove(key)
+                    self.expirations += 1
+
+    def invalidate(self, target):
+        prefix = target + '/'
+
+        self._remove_where(
+            lambda t: t == target or t.startswith(prefix))
+
+    def invalidate_collections(self, resource):
+        self._remove_where(
+            lambda t: t.rsplit('/', 1)[-1] == resource)
+
+    def _remove_where(self, matches):
+        with self._lock:
+            for key, item in list(self._cache.items()):
+                if matches(item['target']):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._bytes = 0
+
+    def stats(self):
+        stats = super(Cache, self).stats()
+        stats.update(entries=len(self._cache), bytes=self._bytes)
+
+        return stats
+
+    def _expired(self, item):
+        ttl = self._ttl_for(item['target'])
+
+        return ttl and time.time() - ttl > item['createTime']
+
+    def _remove(self, key):
+        self._bytes -= self._cache.pop(key)['size']
+
+
+class SqliteCache(SqliteConnection, BaseCache):
+    """Persistent cache of GET responses in a sqlite database, so responses
+    survive the script and can be shared by several processes. Each thread
+    and process opens its own connection; sqlite's locking keeps concurrent
+    writers safe. Expired rows are deleted when read and swept every
+    sweep_interval stores, like Cache
+    """
+
+    def __init__(self, path, cachetime=0, ttls=None, timeout=30, sweep_interval=100):
+        """
+        :param path: database file, created if missing
+        :param cachetime: default seconds entries stay valid, 0 or True for
+            forever
+        :param ttls: see BaseCache
+        :param timeout: seconds to wait for another process holding a lock
+        :param sweep_interval: number of stores between expiry sweeps
+        """
+        super(SqliteCache, self).__init__(cachetime, ttls)
+
+        self.path = path
+        self.timeout = timeout
+        self.sweep_interval = sweep_interval
+        self._stores = 0
+
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, target TEXT, value TEXT, expires REAL)')
+
+    def lookup(self, target, **kwargs):
+        key = self._get_key(target, **kwargs)
+        row = self._connect().execute(
+            'SELECT value, expires FROM responses WHERE key = ?', (key,)).fetchone()
+
+        if row:
+            if not row[1] or row[1] >= time.time():
+                self.hits += 1
+                return json.loads(row[0])
+
+            #only count the expiry if this call removed the row, another
+            #process or a store may have got there first
+            with self._connect() as conn:
+                self.expirations += conn.execute(
+                    'DELETE FROM responses WHERE key = ? AND expires = ?',
+                    (key, row[1])).rowcount
+
+        self.misses += 1
+
+        return self.MISS
+
+    def has(self, target, **kwargs):
+        return self.lookup(target, **kwargs) is not self.MISS
+
+    def get(self, target, **kwargs):
+        row = self._connect().execute(
+            'SELECT value FROM responses WHERE key = ?',
+            (self._get_key(target, **kwargs),)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def store(self, value, target, **kwargs):
+        ttl = self._ttl_for(target)
+
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                (self._get_key(target, **kwargs), target, json.dumps(value),
+                 time.time() + ttl if ttl else 0))
+
+        self._stores += 1
+        if self._stores % self.sweep_interval == 0:
+            self.sweep()
+
+    def invalidate(self, target):
+        with self._connect() as conn:
+            conn.execute(
+                'DELETE FROM responses WHERE target = ? OR substr(target, 1, ?) = ?',
+                (target, len(target) + 1, target + '/'))
+
+    def invalidate_collections(self, resource):
+        with self._connect() as conn:
+            conn.execute(
+                'DELETE FROM responses WHERE target = ? OR substr(target, -?) = ?',
+                (resource, len(resource) + 1, '/' + resource))
+
+    def sweep(self):
+        with self._connect() as conn:
+            self.expirations += conn.execute(
+                'DELETE FROM responses WHERE expires AND expires < ?',
+                (time.time(),)).rowcount
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM responses')
+
+    def stats(self):
+        stats = super(SqliteCache, self).stats()
+        stats['entries'] = self._connect().execute(
+            'SELECT COUNT(*) FROM responses').fetchone()[0]
+
+        return stats
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import threading
+
+
+class SqliteConnection(object):
+	"""Mixin for classes kept in a sqlite database shared by threads and
+	processes. Each thread and process opens its own connection to
+	self.path, waiting up to self.timeout seconds for another process holding
+	a lock
+	"""
+
+	def _connect(self):
+		"""
+		:returns: this thread's connection, reopened after a fork
+		"""
+		local = self.__dict__.get('_local')
+
+		if local is None:
+			local = self.__dict__.setdefault('_local', threading.local())
+
+		if getattr(local, 'pid', None) != os.getpid():
+			local.conn = sqlite3.connect(self.path, timeout=self.timeout)
+			local.pid = os.getpid()
+
+		return local.conn
@@ -3,11 +3,21 @@
 
 import json
 import re
+import threading
+import weakref
+
+from functools import partial
+from operator import eq
+
+from asana.pool import parallel_map
 
 class EntityException(Exception):
     """Wrap entity specific errors"""
     pass
 
+#marks a field that had no value before it was set
+_missing = object()
+
 class Entity(object):
 	"""Base implementation for an Asana entity containing
 	common funcitonality"""
@@ -15,26 +25,52 @@ class Entity(object):
 	# Keys which are filtered as part of the HTTP request
 	_filter_keys = []
 
+	#fields which can be filtered from a date as part of the HTTP request,
+	#mapped to the request param, see Range
+	_range_filter_keys = {}
+
 	#fields this object has. This affects what is returned from the Asana API
 	#as well as serving as a lookup for lazy-loading
 	_fields = []
 
-	#define regex to match field names that should be wrapped with an instance
-	#of this object
+	#fields always requested even when a find uses a narrower projection
+	_required_fields = []
+
+	#compiled (regex, class) pairs matching field names that should be wrapped
+	#with an instance of that class, see set_matchons()
 	_matchons = []
 
+	#field name -> class (or None) memo for _matchons
+	_match_cache = {}
+
+	#optional IdentityMap shared by all entities, see set_identity_map()
+	_identity_map = None
+
 	#items that are sub-items of the current one such that the API endpoint is
 	#/api/parent/<id>/subitme
 	_children = {}
 
+	#number of items requested per page when streaming results
+	page_size = 100
+
+	#if true, accessing an unloaded field on an entity returned by a find
+	#loads the missing fields of all entities from the same result (or page)
+	#at once, see load_many()
+	load_siblings = False
+
+	#number of concurrent requests used by load_many() for siblings
+	load_siblings_workers = 8
+
 	def __init__(self, data):
 		self._childrenValues = {}
+		self._siblings = None
 		self._init(data)
 		self._ready = True
 
 	def _init(self, data, merge=False):
 		"""Initializes this entity, either with entirely new data or with an
-		update to be merged with the current data
+		update to be merged with the current data. Nested values are kept as
+		the raw API dicts until they are accessed, see _get_value
 
 		:param data: the data to use for the entity
 		:param merge: if true only set keys from data that aren't already set
@@ -45,29 +81,89 @@ class Entity(object):
 		else:
 			self._data = data
 			self._dirty = set()
+			self._original = {}
+
+	def _get_value(self, key):
+		"""Returns the value of a data key, wrapping nested dicts with the
+		class matching the key on first access. The wrapped value replaces the
+		raw one so this only happens once
+
+		:param key: the data key, which must be set
+		"""
+		value = self._data[key]
+
+		if isinstance(value, dict) or (
+			isinstance(value, list) and value and isinstance(value[0], dict)
+		):
+			cls = self._get_match(key)
+
+			if cls is None:
+				return value
+
+			if isinstance(value, list):
+				value = [cls._from_data(val) if isinstance(val, dict) else val for val in value]
+			else:
+				value = cls._from_data(value)
+
+			self._data[key] = value
+
+		return value
+
+	@classmethod
+	def set_matchons(cls, matches):
+		"""Compiles the field name regexes that decide which class wraps a
+		field's value and resets the per field name lookup
+
+		:param matches: dict of regex to Entity subclass
+		"""
+		Entity._matchons = [(re.compile(regex), match) for regex, match in matches.items()]
+		Entity._match_cache = {}
+
+	@staticmethod
+	def _get_match(key):
+		"""Looks up the class to wrap the value of field key with, memoized
+		per field name
+
+		:returns: an Entity subclass or None
+		"""
+		try:
+			return Entity._match_cache[key]
+		except KeyError:
+			pass
+
+		match = None
 
-		#todo it would probably be better to subclass
-		# dict and implement this in there
-		for key in self._data:
-			if not self._data[key]:
-				continue
+		for regex, cls in Entity._matchons:
+			if regex.search(key):
+				match = cls
+				break
 
-			for regex, cls in self._matchons.items():
-				if re.search(regex, key):
-					if isinstance(self._data[key], list):
-						for idx, val in enumerate(self._data[key]):
-							if isinstance(val, dict):
-								self._data[key][idx] = cls(val)
-					else:
-						if isinstance(self._data[key], dict):
-							self._data[key] = cls(self._data[key])
+		Entity._match_cache[key] = match
 
-					break
+		return match
 
 	@classmethod
 	def set_api(cls, api):
 		cls.api = api
 
+	@classmethod
+	def set_identity_map(cls, identity_map):
+		"""Makes entities built from API data with the same class and id share
+		one instance, so each is only loaded and held in memory once
+
+		:param identity_map: an IdentityMap, or None to turn this off
+		"""
+		Entity._identity_map = identity_map
+
+	@classmethod
+	def _from_data(cls, data):
+		"""Builds an instance from API data, reusing the one in the identity map
+		if there is one. The reused instance is updated with data"""
+		if Entity._identity_map is None or not data.get('id'):
+			return cls(data)
+
+		return Entity._identity_map.get_or_create(cls, data)
+
 	@classmethod
 	def from_link(cls, link):
 		"""Builds an object from a link to it
@@ -85,6 +181,15 @@ class Entity(object):
 
 		return cls.api
 
+	@classmethod
+	def _get_async_api(cls):
+		api = cls._get_api()
+
+		if not hasattr(api, 'submit'):
+			raise EntityException('Asynchronous operations require an AsyncAsanaAPI')
+
+		return api
+
 	@classmethod
 	def _get_api_endpoint(cls):
 		"""By default use name of class for endpoint"""
@@ -97,59 +202,201 @@ class Entity(object):
 		return '/'.join([self._get_api_endpoint(), str(self.id)])
 
 	@classmethod
-	def find(cls, query={}):
+	def find(cls, query={}, fields=None):
 		"""Find objects of this type that fit query
 
 		:param query: dict of key/value pairs to match against. keys that the
 			API natively handles are sent as part of the request if they have
 			scalar values, other keys are filtered from the response.
-			filter values can be either absolute values or lambdas. for lambdas
-			the value of its key will be passed as the only argument and it
-			will be considered passing if the lambda returns true
+			filter values can be either absolute values, lambdas or Ranges.
+			for lambdas the value of its key will be passed as the only
+			argument and it will be considered passing if the lambda returns
+			true. See Query for how a query is split and explain() to check
+		:param fields: optional projection of the fields to request, defaults
+			to _fields. Nested fields such as 'assignee.name' are allowed.
+			Keys of query filtered locally are added. Fields left out are
+			loaded when first accessed
 		"""
-		return cls._run_find(cls._get_api_endpoint(), query)
+		return cls._run_find(cls._get_api_endpoint(), query, fields)
+
+	@classmethod
+	def afind(cls, query={}, fields=None):
+		"""Asynchronous find(), returning a Future for the result list"""
+		return cls._get_async_api().submit(cls.find, query, fields)
 
 	@classmethod
-	def _run_find(cls, target, query):
-		params = cls._get_default_params() #params that are part of the request
+	def find_iter(cls, query={}, page_size=None, fields=None):
+		"""Lazily find objects of this type that fit query, following the API's
+		pagination so only one page is held in memory at a time
 
-		#todo handle lambdas that are passed in for filter keys
-		if cls._filter_keys:
-			for key in query.keys():
-				if key in cls._filter_keys:
-					params[key] = query[key]
-					del query[key]
+		:param query: see find()
+		:param page_size: number of items requested per page
+		:param fields: see find()
+		"""
+		return cls._run_find_iter(cls._get_api_endpoint(), query, page_size, fields=fields)
+
+	@classmethod
+	def _run_find(cls, target, query, fields=None):
+		params, query = cls._split_query(query, fields)
 
 		data = cls._get_api().get(target, params=params)
 
 		return cls._build_result(query, data)
 
 	@classmethod
-	def _get_default_params(cls):
+	def find_table(cls, query={}, page_size=None, fields=None):
+		"""Find objects of this type that fit query, storing them in a compact
+		EntityTable rather than as individual instances
+
+		:param query: see find()
+		:param page_size: number of items requested per page
+		:param fields: see find(), also decides the table's columns
+		"""
+		return cls._run_find_table(cls._get_api_endpoint(), query, page_size, fields)
+
+	@classmethod
+	def _run_find_iter(cls, target, query, page_size=None, raw=False, fields=None):
+		params, query = cls._split_query(query, fields)
+
+		pages = cls._get_api().get_pages(
+			target, params=params, page_size=page_size or cls.page_size
+		)
+
+		if raw:
+			return cls._iter_raw(query, pages)
+
+		return cls._iter_result(query, pages)
+
+	@classmethod
+	def _run_find_table(cls, target, query, page_size=None, fields=None):
+		columns = ['id'] + cls._top_level_fields(fields) if fields else None
+
+		table = EntityTable(cls, columns)
+		table.extend(cls._run_find_iter(target, query, page_size, raw=True, fields=fields))
+
+		return table
+
+	@classmethod
+	def _split_query(cls, query, fields=None):
+		"""Splits a query into the params that are part of the request and the
+		remaining keys which are filtered from the response
+
+		:param query: dict or an already compiled Query
+		:param fields: optional field projection, see find()
+		:returns: tuple of (params, Query)
+		"""
+		if not isinstance(query, Query):
+			query = Query(cls, query, fields)
+
+		return dict(query.params), query
+
+	@classmethod
+	def explain(cls, query={}, fields=None):
+		"""Describes which parts of a find query are sent to the API and which
+		are filtered locally
+
+		:param query: see find()
+		:param fields: see find()
+		"""
+		return Query(cls, query, fields).explain()
+
+	@classmethod
+	def _get_default_params(cls, fields=None):
 		"""Hook to add params that will always be part of a find request
 		Default behavior checks for the 'fields' property and, if present,
 		joins it with commas and passes it as the opt_fields param
+
+		:param fields: optional projection used instead of the 'fields'
+			property. Fields in _required_fields are always added
 		"""
-		if cls._fields:
+		if fields:
+			fields = list(fields)
+			fields.extend(f for f in cls._required_fields if f not in fields)
+		else:
+			fields = cls._fields
+
+		if fields:
 			return {
-				'opt_fields': ','.join(cls._fields)
+				'opt_fields': ','.join(fields)
 			}
 
 		return {}
 
+	@staticmethod
+	def _top_level_fields(fields):
+		"""Maps a projection to the keys it sets, e.g. 'assignee.name' sets
+		'assignee'"""
+		ret = []
+
+		for field in fields:
+			field = field.split('.')[0]
+
+			if field not in ret:
+				ret.append(field)
+
+		return ret
+
 	@classmethod
 	def _build_result(cls, query, data):
 		"""Filters the result set based on a query returning the resulting
 		objects as instances of the current class"""
 		
-		return [cls(ent) for ent in data if cls._filter_result_item(ent, query)]
+		return cls._link_siblings(
+			[cls._from_data(ent) for ent in data if cls._filter_result_item(ent, query)]
+		)
+
+	@classmethod
+	def _iter_result(cls, query, pages):
+		"""Streaming counterpart of _build_result, consuming an iterable of
+		pages and yielding instances of the current class"""
+
+		if not cls.load_siblings:
+			for ent in cls._iter_raw(query, pages):
+				yield cls._from_data(ent)
+
+			return
+
+		#link siblings a page's worth at a time to keep memory flat
+		batch = []
+
+		for ent in cls._iter_raw(query, pages):
+			batch.append(cls._from_data(ent))
+
+			if len(batch) >= cls.page_size:
+				for sibling in cls._link_siblings(batch):
+					yield sibling
+				batch = []
+
+		for sibling in cls._link_siblings(batch):
+			yield sibling
+
+	@classmethod
+	def _link_siblings(cls, entities):
+		"""Records entities as each other's siblings if load_siblings is on"""
+		if cls.load_siblings:
+			for ent in entities:
+				ent._siblings = entities
+
+		return entities
+
+	@classmethod
+	def _iter_raw(cls, query, pages):
+		"""Yields the dicts from an iterable of pages that pass the query"""
+
+		for page in pages:
+			for ent in page:
+				if cls._filter_result_item(ent, query):
+					yield ent
 
 	@classmethod
 	def _filter_result_item(cls, entity, query):
-		"""Filters a single entity dict against a dict of allowed values
-		returning true if it passes
+		"""Filters a single entity dict against a dict of allowed values or a
+		compiled Query returning true if it passes
 		"""
 
+		if isinstance(query, Query):
+			return query.matches(entity)
+
 		for key, value in query.items():
 			if key not in entity:
 				raise EntityException('The key {0} is not a valid query for {1}'.format(key, cls.__name__))
@@ -161,18 +408,85 @@ class Entity(object):
 				return False
 		return True
 
-	def load(self):
-		"""Loads all of this items data using its ID"""
+	def load(self, fields=None):
+		"""Loads all of this items data using its ID
+
+		:param fields: optional projection of the fields to load, see find()
+		"""
+		kwargs = {'params': {'opt_fields': ','.join(fields)}} if fields else {}
 
-		#TODO check if sending in empty opt_fields will make us lose all fields
-		self._init(self._get_api().get(self._get_item_url()), merge=True)
+		self._init(self._get_api().get(self._get_item_url(), **kwargs), merge=True)
 
 		return self
 
-	def get_subitem(self, subitem_class, query={}):
+	@classmethod
+	def load_many(cls, entities, fields=None, max_workers=8):
+		"""Loads many entities concurrently, skipping those which already have
+		all of fields set
+
+		:param entities: entities to load
+		:param fields: fields that must be present, defaults to _fields. If
+			given only these are requested, see find()
+		:param max_workers: number of requests to run at once
+		"""
+		entities = list(entities)
+		required = cls._top_level_fields(fields) if fields else cls._fields
+
+		missing = [
+			ent for ent in entities
+			if ent.id and any(f not in ent._data for f in required)
+		]
+
+		parallel_map(lambda ent: ent.load(fields), missing, max_workers)
+
+		return entities
+
+	def aload(self, fields=None):
+		"""Asynchronous load(), returning a Future for this entity"""
+		return self._get_async_api().submit(self.load, fields)
+
+	def subitem_table(self, subitem_class, query={}, page_size=None, fields=None):
+		"""EntityTable counterpart of get_subitem, see find_table()"""
+		target = '/'.join([self._get_item_url(), subitem_class._get_api_endpoint()])
+
+		return subitem_class._run_find_table(target, query, page_size, fields)
+
+	def get_subitem(self, subitem_class, query={}, fields=None):
 		target = '/'.join([self._get_item_url(), subitem_class._get_api_endpoint()])
 
-		return subitem_class._run_find(target, query)
+		return subitem_class._run_find(target, query, fields)
+
+	def iter_subitem(self, subitem_class, query={}, page_size=None, fields=None):
+		"""Streaming counterpart of get_subitem, see find_iter()"""
+		target = '/'.join([self._get_item_url(), subitem_class._get_api_endpoint()])
+
+		return subitem_class._run_find_iter(target, query, page_size, fields=fields)
+
+	@classmethod
+	def prefetch_children(cls, entities, child, query={}, max_workers=8, fields=None):
+		"""Loads a child collection for many entities concurrently so later
+		attribute access doesn't make a request. All requests share the api's
+		connection pool so max_workers should not exceed its pool_maxsize
+
+		:param entities: entities to load the children of
+		:param child: name of the child collection, e.g. 'tasks'
+		:param query: optional query applied to every child request
+		:param max_workers: number of requests to run at once
+		:param fields: optional projection of the children's fields, see find()
+		"""
+		entities = list(entities)
+
+		for ent in entities:
+			if child not in ent._children:
+				raise EntityException('{0} has no children named {1}'.format(
+					ent.__class__.__name__, child))
+
+		def fetch(ent):
+			ent._childrenValues[child] = ent.get_subitem(ent._children[child], query, fields)
+
+		parallel_map(fetch, entities, max_workers)
+
+		return entities
 
 	def save(self):
 		"""Handles both creating and updating content
@@ -186,19 +500,65 @@ class Entity(object):
 			#performing create - post
 			return self._do_create()
 
-	def _do_update(self):
-		data = {}
+	def asave(self):
+		"""Asynchronous save(), returning a Future"""
+		return self._get_async_api().submit(self.save)
 
-		for key in self._dirty:
-			data[key] = self._data[key]
+	def _do_update(self):
+		data = self._changes()
 
 		if not data:
+			self._clean(self._dirty)
 			return
 
-		return self._get_api().put(self._get_item_url(), data=data)
+		return self._apply_result(
+			self._get_api().put(self._get_item_url(), data=data),
+			lambda result: self._clean(data, data)
+		)
+
+	def _changes(self):
+		"""
+		:returns: dict of the dirty keys whose value differs from the one
+			they had before they were first set
+		"""
+		return dict(
+			(key, self._data[key]) for key in self._dirty
+			if self._data[key] != self._original.get(key, _missing)
+		)
+
+	def _clean(self, keys, sent=None):
+		"""Marks keys as saved. Keys set again since sent was built stay
+		dirty
+
+		:param sent: optional dict of the values that were saved
+		"""
+		for key in list(keys):
+			if sent is None or self._data.get(key) is sent[key]:
+				self._dirty.discard(key)
+				self._original.pop(key, None)
 
 	def _do_create(self):
-		return self._init(self._get_api().post(self._get_api_endpoint(), data=self._data))
+		return self._apply_result(
+			self._get_api().post(self._get_api_endpoint(), data=self._data),
+			self._init
+		)
+
+	@staticmethod
+	def _apply_result(result, callback):
+		"""Passes an API result to callback. Inside AsanaAPI.batch() results are
+		futures, in which case callback runs once the batch is submitted and
+		only if the request succeeded
+
+		:returns: result
+		"""
+		if hasattr(result, 'add_done_callback'):
+			result.add_done_callback(
+				lambda future: future.exception() is None and callback(future.result())
+			)
+		else:
+			callback(result)
+
+		return result
 
 	def delete(self):
 		"""Deletes the specified resource. The ID must be set"""
@@ -211,11 +571,16 @@ class Entity(object):
 			return self.__dict__[attr]
 
 		if attr in self.__dict__['_data']:
-			return self.__dict__['_data'][attr]
+			return self._get_value(attr)
 
 		if attr in self._fields:
-			self.load()
-			return self.__dict__['_data'][attr]
+			if self._siblings and self.load_siblings:
+				siblings = [s for s in self._siblings if attr not in s._data]
+				self.load_many(siblings, max_workers=self.load_siblings_workers)
+			else:
+				self.load()
+
+			return self._get_value(attr)
 
 
 		if attr in self._children.keys():
@@ -225,6 +590,9 @@ class Entity(object):
 
 			return self._childrenValues[attr]
 
+		if attr.startswith('iter_') and attr[5:] in self._children.keys():
+			return partial(self.iter_subitem, self._children[attr[5:]])
+
 		if attr != 'id':
 			#todo throw standard exception for no property
 			raise Exception("Could not locate key " + attr)
@@ -235,10 +603,13 @@ class Entity(object):
 		elif self._ready:
 
 			if attr in self._fields:
+				if attr not in self._dirty:
+					self._original[attr] = self._data.get(attr, _missing)
+
 				self._data[attr] = value
 				self._dirty.add(attr)
 			else:
-				raise Exception("Cannot set attribute {0} - unknown name".foramt(attr))
+				raise Exception("Cannot set attribute {0} - unknown name".format(attr))
 
 	def __str__(self):
 		return vars(self).__repr__()
@@ -257,3 +628,296 @@ class Entity(object):
 			return self.id == other.id
 		else:
 			return cmp(self._data, other._data) == 0
+
+
+class Range(object):
+	"""Query value matching values between start and end (both inclusive).
+	Either bound may be left out. Asana timestamps are ISO 8601 strings so
+	they compare correctly as strings
+
+		Task.find({'modified_at': Range(start='2015-01-01T00:00:00Z')})
+	"""
+
+	def __init__(self, start=None, end=None):
+		self.start = start
+		self.end = end
+
+	def __call__(self, value):
+		if value is None:
+			return False
+
+		if self.start is not None and value < self.start:
+			return False
+
+		if self.end is not None and value > self.end:
+			return False
+
+		return True
+
+	def __repr__(self):
+		return 'Range({0!r}, {1!r})'.format(self.start, self.end)
+
+
+class Query(object):
+	"""A find query compiled once for an entity class. Constraints the API
+	understands are turned into request params, everything else into a list
+	of per key tests which is run against each result
+
+	Pushed to the API:
+	 - values for the class's _filter_keys which aren't callable, entities
+	   being sent as their id
+	 - the start of a Range on a key in the class's _range_filter_keys, e.g.
+	   modified_at -> modified_since. The Range is still checked locally as
+	   the API's semantics are looser
+	Checked locally:
+	 - callables, passing if they return true for the value
+	 - Ranges
+	 - any other value, passing if equal (entities match by id)
+	"""
+
+	def __init__(self, cls, query=None, fields=None):
+		"""
+		:param cls: the Entity subclass being queried
+		:param query: dict of key to value, see Entity.find()
+		:param fields: optional field projection, see Entity.find()
+		"""
+		self.cls = cls
+		self.params = cls._get_default_params(fields)
+		self.pushed = []
+		self.tests = []
+		self._descriptions = []
+
+		for key, value in (query or {}).items():
+			self._compile(key, value)
+
+		#a projection must include the keys tested locally
+		if self.params.get('opt_fields'):
+			fields = self.params['opt_fields'].split(',')
+			top = cls._top_level_fields(fields)
+			fields.extend(key for key, _ in self.tests if key not in top)
+			self.params['opt_fields'] = ','.join(fields)
+
+	def _compile(self, key, value):
+		if key in self.cls._filter_keys and not callable(value):
+			self.params[key] = _entity_id(value)
+			self.pushed.append(key)
+			return
+
+		param = self.cls._range_filter_keys.get(key)
+
+		if param and isinstance(value, Range) and value.start is not None:
+			self.params[param] = value.start
+			self.pushed.append(param)
+
+		if callable(value):
+			test = value
+		elif _entity_id(value) is not value:
+			test = partial(_same_entity, _entity_id(value))
+		else:
+			test = partial(eq, value)
+
+		self.tests.append((key, test))
+		self._descriptions.append('{0} {1!r}'.format(key, value))
+
+	def matches(self, entity):
+		"""Checks an entity dict from the API against the local tests"""
+		for key, test in self.tests:
+			try:
+				value = entity[key]
+			except KeyError:
+				raise EntityException('The key {0} is not a valid query for {1}'.format(
+					key, self.cls.__name__))
+
+			if not test(value):
+				return False
+
+		return True
+
+	def explain(self):
+		"""Describes what is sent to the API and what is filtered locally"""
+		lines = ['{0} query'.format(self.cls.__name__)]
+
+		for key in sorted(self.params):
+			lines.append('  server: {0}={1}'.format(key, self.params[key]))
+
+		for description in self._descriptions:
+			lines.append('  client: {0}'.format(description))
+
+		return '\n'.join(lines)
+
+	def __repr__(self):
+		return self.explain()
+
+def _entity_id(value):
+	"""Returns the id of an entity, any other value is returned as is"""
+	if isinstance(value, Entity):
+		return value.id
+
+	return value
+
+
+def _to_json(value):
+	"""Converts entities nested in value back to the dicts they were built from"""
+	if isinstance(value, Entity):
+		value = value._data
+
+	if isinstance(value, dict):
+		return dict((k, _to_json(v)) for k, v in value.items())
+
+	if isinstance(value, list):
+		return [_to_json(v) for v in value]
+
+	return value
+
+
+def _same_entity(id, value):
+	if isinstance(value, dict):
+		return value.get('id') == id
+
+	return getattr(value, 'id', value) == id
+
+
+class IdentityMap(object):
+	"""Registry of the live entity instances keyed by (class, id). Only weak
+	references are held so instances are freed once nothing else uses them"""
+
+	def __init__(self):
+		self._instances = weakref.WeakValueDictionary()
+		self._lock = threading.Lock()
+
+	def get_or_create(self, cls, data):
+		"""Returns the instance of cls with data's id, creating it from data if
+		needed. An existing instance is updated with data except for fields
+		changed locally and not yet saved"""
+		key = (cls, data['id'])
+
+		with self._lock:
+			instance = self._instances.get(key)
+
+			if instance is None:
+				instance = cls(data)
+				self._instances[key] = instance
+				return instance
+
+		instance._init(
+			dict((k, v) for k, v in data.items() if k not in instance._dirty),
+			merge=True
+		)
+
+		return instance
+
+	def clear(self):
+		with self._lock:
+			self._instances.clear()
+
+	def __len__(self):
+		return len(self._instances)
+
+
+class EntityTable(object):
+	"""Column oriented store for many entities of one class. Each field is
+	kept in its own list so holding a large result set costs little more than
+	the values themselves. Rows are read through lightweight EntityRow views
+	offering the same attribute access as the entity class; fields that
+	weren't part of the result are None rather than lazy loaded
+	"""
+
+	def __init__(self, cls, columns=None):
+		"""
+		:param cls: the Entity subclass stored
+		:param columns: fields to keep, defaults to id plus cls._fields
+		"""
+		self.cls = cls
+		self.columns = list(columns or ['id'] + [f for f in cls._fields if f != 'id'])
+		self._columns = dict((name, []) for name in self.columns)
+		self._length = 0
+
+	def append(self, data):
+		"""Adds an entity dict as a new row. Keys which aren't columns are
+		dropped"""
+		for name, column in self._columns.items():
+			column.append(data.get(name))
+
+		self._length += 1
+
+	def extend(self, items):
+		for data in items:
+			self.append(data)
+
+	def column(self, name):
+		"""Returns the raw values of a field for all rows"""
+		return self._columns[name]
+
+	def row_data(self, index):
+		"""Returns a row as a dict"""
+		return dict((name, column[index]) for name, column in self._columns.items())
+
+	def to_entities(self):
+		"""Expands every row into a full instance of the entity class"""
+		return [self.cls(self.row_data(idx)) for idx in range(self._length)]
+
+	def _get_value(self, name, index):
+		"""Returns a cell, wrapping nested dicts like Entity._get_value does
+		and storing the wrapped value back into the column"""
+		column = self._columns[name]
+		value = column[index]
+
+		if isinstance(value, dict) or (
+			isinstance(value, list) and value and isinstance(value[0], dict)
+		):
+			cls = Entity._get_match(name)
+
+			if cls is not None:
+				if isinstance(value, list):
+					value = [cls._from_data(val) if isinstance(val, dict) else val for val in value]
+				else:
+					value = cls._from_data(value)
+
+				column[index] = value
+
+		return value
+
+	def __len__(self):
+		return self._length
+
+	def __getitem__(self, index):
+		if index < 0:
+			index += self._length
+
+		if not 0 <= index < self._length:
+			raise IndexError('EntityTable index out of range')
+
+		return EntityRow(self, index)
+
+	def __iter__(self):
+		for index in range(self._length):
+			yield EntityRow(self, index)
+
+
+class EntityRow(object):
+	"""Read only view of one row of an EntityTable"""
+
+	__slots__ = ('_table', '_index')
+
+	def __init__(self, table, index):
+		self._table = table
+		self._index = index
+
+	def __getattr__(self, attr):
+		if attr not in self._table._columns:
+			raise AttributeError('Could not locate key ' + attr)
+
+		return self._table._get_value(attr, self._index)
+
+	def to_entity(self):
+		"""Expands this row into a full instance of the entity class"""
+		return self._table.cls(self._table.row_data(self._index))
+
+	def __repr__(self):
+		return '{0}Row({1})'.format(self._table.cls.__name__, self._table.row_data(self._index))
+
+	def __eq__(self, other):
+		return isinstance(other, EntityRow) and self.to_entity() == other.to_entity()
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
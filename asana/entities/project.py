@@ -23,3 +23,12 @@ class Project(Entity):
 			task.workspace = self.workspace.id
 
 			task.save()
+
+	def sync_tasks(self, state, full=False):
+		"""Incrementally syncs this project's tasks into a SyncState
+
+		:param state: the SyncState holding the previous sync
+		:param full: if true fetch every task, which also detects removals
+		:returns: SyncResult listing added, changed and removed task ids
+		"""
+		return state.sync(self, full)
\ No newline at end of file
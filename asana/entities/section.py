@@ -1,4 +1,5 @@
-from entity import Entity
+from entity import Entity, EntityException
+from itertools import chain
 import task
 
 class Section(task.Task):
@@ -20,25 +21,39 @@ class Section(task.Task):
 		returned in order so every task after a section until the next section
 		is considered a subtask
 		"""
+		return cls._link_siblings([cls._from_data(ent) for ent in cls._group(query, data)])
+
+	@classmethod
+	def _iter_raw(cls, query, pages):
+		"""Sections can span pages so pages are chained into one stream, each
+		section is yielded once the next header arrives"""
+		return cls._group(query, chain.from_iterable(pages))
+
+	@classmethod
+	def _group(cls, query, data):
+		"""Groups the tasks following each section header passing query into
+		its subtasks. Only the section being filled is held so memory is
+		bounded by the largest section rather than the whole project
+
+		:param data: iterable of task dicts in project order
+		:returns: generator of section dicts
+		"""
 		current = None
-		ret = []
 
 		for ent in data:
 			if cls._is_section(ent):
-				if current:
-					ret.append(cls(current))
-					current = None
+				if current is not None:
+					yield current
+
+				current = None
 
 				if cls._filter_result_item(ent, query):
-					current = ent
-					current['subtasks'] = []
-			elif current:
+					current = dict(ent, subtasks=[])
+			elif current is not None:
 				current['subtasks'].append(ent)
 
-		if current:
-			ret.append(cls(current))
-
-		return ret
+		if current is not None:
+			yield current
 
 	@staticmethod
 	def _is_section(ent):
@@ -48,5 +63,5 @@ class Section(task.Task):
 		"""
 		return ent['name'] and ent['name'][-1] == ':'
 
-	def get_subitem(self, subclass, query):
+	def get_subitem(self, subclass, query={}, fields=None):
 		raise EntityException('This function does not apply to sections, try the subtasks property')
\ No newline at end of file
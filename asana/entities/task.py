@@ -16,6 +16,13 @@ class Task(Entity):
 		'workspace'
 	]
 
+	_range_filter_keys = {
+		'modified_at': 'modified_since', 'completed_at': 'completed_since'
+	}
+
+	#needed to tell sections apart from tasks
+	_required_fields = ['name']
+
 	_children = {
 		'tags': None
 	}
@@ -58,9 +65,10 @@ class Task(Entity):
 		"""
 		return self._edit_project('removeProject', projectOrId)
 
-	def _edit_project(self, operation, projectOrId, data={}):
+	def _edit_project(self, operation, projectOrId, data=None):
 		pId = projectOrId.id if isinstance(projectOrId, project.Project) else projectOrId
 
+		data = dict(data or {})
 		data['project'] = pId
 
 		return self._get_api().post(
@@ -68,21 +76,26 @@ class Task(Entity):
 			data=data
 		)
 
-	def add_to_section(self, section):
+	def add_to_section(self, section, projectOrId=None):
 		"""Moves this task to a section
 
 		If this task and the section share one or more projects the first one
-		found is used. If they don't the first project in the section is used
+		found is used. If they don't the first project in the section is used.
+		To move many tasks at once see LayoutPlan
 
 		:param section The section to move to
+		:param projectOrId The project the section is in, skips looking it up
 		"""
 
-		sharedProjects = set(self.projects) & set(section.projects)
-
-		if len(sharedProjects):
-			pId = sharedProjects.pop()
+		if projectOrId is not None:
+			pId = projectOrId
 		else:
-			pId = section.projects[0]
+			sharedProjects = set(self.projects) & set(section.projects)
+
+			if len(sharedProjects):
+				pId = sharedProjects.pop()
+			else:
+				pId = section.projects[0]
 		
 		return self._edit_project(
 			'addProject',
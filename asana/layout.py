@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect, json, sys, threading
+
+from collections import namedtuple
+
+from entities import Entity, Task
+from entities.entity import _entity_id
+from pool import parallel_map
+
+Move = namedtuple('Move', ['task', 'insert_after', 'insert_before'])
+
+
+class LayoutPlan(object):
+	"""The moves turning a project's current task order into a desired
+	layout of sections and their tasks.
+
+	Sections and tasks already in the right relative order (the longest
+	increasing subsequence of their current positions) stay where they are,
+	everything else is moved with addProject. Each run of moved tasks is
+	anchored on the task before it that doesn't move, so runs don't depend on
+	each other and are executed concurrently while the moves inside a run go
+	in order. Completed moves are remembered, after a failure execute() can
+	be called again (or the plan saved and loaded) to continue where it
+	stopped.
+
+		plan = LayoutPlan(project, [
+			(None, [pinned]),
+			(sectionA, [task1, task2]),
+			(sectionB, [task3])
+		])
+		plan.execute(progress=lambda done, total: sys.stdout.write('.'))
+
+	Tasks in the project that aren't part of the layout are left where they
+	are, so they stay in whichever section they currently sit in.
+	"""
+
+	def __init__(self, project, layout, current=None):
+		"""
+		:param project: Project or project id to reorganize
+		:param layout: list of (section, tasks) pairs or an OrderedDict, in
+			the order they should appear. Sections and tasks can be entities
+			or ids and must exist already. A section of None holds the tasks
+			before the first section
+		:param current: ids in the project's current order, fetched when not
+			given
+		"""
+		self.project = _entity_id(project)
+		self.completed = set()
+		self.failed = {}
+		self._lock = threading.Lock()
+
+		if layout is None:
+			self.chains = []
+			return
+
+		if current is None:
+			current = self.fetch_order(self.project)
+
+		self.chains = self.diff(current, self.flatten(layout))
+
+	@property
+	def moves(self):
+		return [move for chain in self.chains for move in chain]
+
+	@property
+	def pending(self):
+		return [move for move in self.moves if move.task not in self.completed]
+
+	def execute(self, max_workers=8, progress=None):
+		"""Runs the pending moves. A chain stops at its first failing move as
+		the rest of it is anchored on that one, the other chains carry on.
+		Failures are kept in failed and the first one is raised once every
+		chain has stopped
+
+		:param max_workers: number of chains moved at once
+		:param progress: optional callable receiving (completed, total) after
+			each move
+		:returns: self
+		"""
+		total = len(self.moves)
+		errors = []
+		self.failed = {}
+
+		def run(chain):
+			for move in chain:
+				if move.task in self.completed:
+					continue
+
+				try:
+					self._apply(move)
+				except Exception as e:
+					with self._lock:
+						self.failed[move.task] = e
+						errors.append(sys.exc_info())
+
+					return
+
+				with self._lock:
+					self.completed.add(move.task)
+					done = len(self.completed)
+
+				if progress:
+					progress(done, total)
+
+		parallel_map(run, [c for c in self.chains if c[-1].task not in self.completed], max_workers)
+
+		if errors:
+			raise errors[0][0], errors[0][1], errors[0][2]
+
+		return self
+
+	def save(self, path):
+		"""Writes the plan and its progress to a JSON file"""
+		with open(path, 'w') as f:
+			json.dump({
+				'project': self.project,
+				'chains': [[list(move) for move in chain] for chain in self.chains],
+				'completed': list(self.completed)
+			}, f)
+
+	@classmethod
+	def load(cls, path):
+		"""Reads a plan written by save()"""
+		with open(path) as f:
+			state = json.load(f)
+
+		plan = cls(state['project'], None)
+		plan.chains = [[Move(*move) for move in chain] for chain in state['chains']]
+		plan.completed = set(state['completed'])
+
+		return plan
+
+	def _apply(self, move):
+		data = {}
+
+		if move.insert_after is not None:
+			data['insert_after'] = move.insert_after
+		elif move.insert_before is not None:
+			data['insert_before'] = move.insert_before
+
+		Task({'id': move.task})._edit_project('addProject', self.project, data)
+
+	@staticmethod
+	def fetch_order(project, page_size=100):
+		"""
+		:returns: ids of the project's tasks and sections in their order
+		"""
+		pages = Entity._get_api().get_pages(
+			'projects/{0}/tasks'.format(project),
+			params={'opt_fields': 'id'}, page_size=page_size
+		)
+
+		return [ent['id'] for page in pages for ent in page]
+
+	@staticmethod
+	def flatten(layout):
+		"""
+		:returns: the layout as a list of ids, each section followed by its
+			tasks
+		"""
+		if hasattr(layout, 'items'):
+			layout = layout.items()
+
+		order = []
+
+		for section, tasks in layout:
+			if section is not None:
+				order.append(_entity_id(section))
+
+			order.extend(_entity_id(task) for task in tasks)
+
+		return order
+
+	@staticmethod
+	def diff(current, desired):
+		"""Finds the moves turning current into desired
+
+		:param current: ids in their current order, may contain ids missing
+			from desired
+		:param desired: ids in the wanted order, may contain ids missing from
+			current which are then added
+		:returns: list of chains, each a list of Moves to run in order
+		"""
+		positions = dict((id, pos) for pos, id in enumerate(current))
+		stay = _longest_increasing(
+			[i for i, id in enumerate(desired) if id in positions],
+			lambda i: positions[desired[i]]
+		)
+
+		chains = []
+		chain = None
+
+		for i, id in enumerate(desired):
+			if i in stay:
+				chain = None
+				continue
+
+			if chain is None:
+				chain = []
+				chains.append(chain)
+
+			chain.append(Move(id, desired[i - 1] if i else None, None))
+
+		#moves ahead of the first task that stays are placed before it, last
+		#one first
+		if chains and chains[0][0].insert_after is None and len(chains[0]) < len(desired):
+			head = chains[0]
+			before = desired[len(head)]
+			chains[0] = []
+
+			for move in reversed(head):
+				chains[0].append(Move(move.task, None, before))
+				before = move.task
+
+		return chains
+
+
+def _longest_increasing(items, key):
+	"""
+	:returns: set of the items forming the longest subsequence whose keys
+		increase
+	"""
+	tails = []
+	tailItems = []
+	parents = {}
+
+	for item in items:
+		value = key(item)
+		pos = bisect.bisect_left(tails, value)
+
+		parents[item] = tailItems[pos - 1] if pos else None
+
+		if pos == len(tails):
+			tails.append(value)
+			tailItems.append(item)
+		else:
+			tails[pos] = value
+			tailItems[pos] = item
+
+	ret = set()
+	item = tailItems[-1] if tailItems else None
+
+	while item is not None:
+		ret.add(item)
+		item = parents[item]
+
+	return ret
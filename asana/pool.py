@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import threading
+
+try:
+	from queue import Queue
+except ImportError:
+	from Queue import Queue
+
+
+class Future(object):
+	"""The pending result of a call running on a WorkerPool"""
+
+	def __init__(self):
+		self._event = threading.Event()
+		self._lock = threading.Lock()
+		self._callbacks = []
+		self._result = None
+		self._exc_info = None
+
+	def done(self):
+		return self._event.is_set()
+
+	def result(self, timeout=None):
+		"""Waits for the call to finish and returns its result, re-raising any
+		exception it raised
+
+		:param timeout: seconds to wait before giving up. None waits forever
+		"""
+		if not self._event.wait(timeout):
+			raise RuntimeError('Timed out waiting for result')
+
+		if self._exc_info:
+			raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+		return self._result
+
+	def exception(self, timeout=None):
+		"""Waits for the call to finish and returns the exception it raised,
+		if any"""
+		if not self._event.wait(timeout):
+			raise RuntimeError('Timed out waiting for result')
+
+		return self._exc_info[1] if self._exc_info else None
+
+	def add_done_callback(self, fn):
+		"""Calls fn with this future once it is done, immediately if it already
+		is"""
+		with self._lock:
+			if not self.done():
+				self._callbacks.append(fn)
+				return
+
+		fn(self)
+
+	def set_result(self, result):
+		self._result = result
+		self._finish()
+
+	def set_exception(self, exc_info):
+		"""
+		:param exc_info: a sys.exc_info() tuple
+		"""
+		self._exc_info = exc_info
+		self._finish()
+
+	def _finish(self):
+		with self._lock:
+			self._event.set()
+			callbacks, self._callbacks = self._callbacks, []
+
+		for fn in callbacks:
+			fn(self)
+
+
+class WorkerPool(object):
+	"""A fixed set of daemon threads running submitted calls. Threads are
+	started lazily on first submit"""
+
+	def __init__(self, max_workers=8):
+		self.max_workers = max_workers
+		self._queue = Queue()
+		self._threads = []
+		self._lock = threading.Lock()
+
+	def submit(self, fn, *args, **kwargs):
+		"""Schedules fn(*args, **kwargs) to run on the pool
+
+		:returns: a Future for its result
+		"""
+		future = Future()
+		self._ensure_threads()
+		self._queue.put((future, fn, args, kwargs))
+
+		return future
+
+	def map(self, fn, items):
+		"""Runs fn over items concurrently, returning the results in order.
+		If any call fails the first exception is raised after all calls have
+		finished"""
+		futures = [self.submit(fn, item) for item in items]
+
+		for future in futures:
+			future.exception()
+
+		return [future.result() for future in futures]
+
+	def shutdown(self):
+		"""Stops all threads once the queued calls are done"""
+		with self._lock:
+			for _ in self._threads:
+				self._queue.put(None)
+
+			threads, self._threads = self._threads, []
+
+		for thread in threads:
+			thread.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.shutdown()
+
+	def _ensure_threads(self):
+		with self._lock:
+			while len(self._threads) < self.max_workers:
+				thread = threading.Thread(target=self._work)
+				thread.daemon = True
+				thread.start()
+				self._threads.append(thread)
+
+	def _work(self):
+		while True:
+			job = self._queue.get()
+
+			if job is None:
+				return
+
+			future, fn, args, kwargs = job
+
+			try:
+				future.set_result(fn(*args, **kwargs))
+			except Exception:
+				future.set_exception(sys.exc_info())
+
+
+def parallel_map(fn, items, max_workers=8):
+	"""Runs fn over items on a short lived pool, see WorkerPool.map"""
+	items = list(items)
+
+	if len(items) < 2 or max_workers < 2:
+		return [fn(item) for item in items]
+
+	with WorkerPool(min(max_workers, len(items))) as pool:
+		return pool.map(fn, items)
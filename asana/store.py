@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect, json
+
+from collections import defaultdict
+
+from entities import Entity, Task
+from entities.entity import EntityException, Range, _to_json
+from db import SqliteConnection
+
+
+class BaseTaskStore(object):
+	"""Local copy of tasks indexed by the fields reports usually group or
+	filter on, so those questions are answered without API calls. Populate it
+	from Task.find, project children or a SyncState:
+
+		store = TaskStore()
+		store.load_projects(Project.find({'name': lambda n: n.startswith('Team')}))
+		store.find({'assignee': me, 'completed': False})
+		store.group_by('created_by')
+
+	Query values on the indexed keys can be a value or entity, a list, set or
+	tuple of them matching any, or a Range for modified_at. A task missing an
+	indexed field is treated as if the field were None, or as in no project
+	"""
+
+	#query key -> task field
+	indexed = {
+		'assignee': 'assignee', 'created_by': 'created_by', 'project': 'projects',
+		'completed': 'completed', 'modified_at': 'modified_at'
+	}
+
+	def add(self, tasks):
+		"""Adds or replaces tasks
+
+		:param tasks: Task instances or raw task dicts
+		:returns: number of tasks added
+		"""
+		raise NotImplementedError
+
+	def remove(self, ids):
+		"""Removes the tasks with ids, unknown ids are ignored"""
+		raise NotImplementedError
+
+	def get(self, id):
+		"""
+		:returns: the Task with id or None
+		"""
+		raise NotImplementedError
+
+	def find(self, query=None):
+		"""
+		:param query: dict of indexed key to value, see the class docstring.
+			Empty or None returns every task
+		:returns: list of matching Tasks ordered by id
+		"""
+		raise NotImplementedError
+
+	def clear(self):
+		raise NotImplementedError
+
+	def __len__(self):
+		raise NotImplementedError
+
+	def __contains__(self, id):
+		return self.get(id) is not None
+
+	def group_by(self, key, query=None):
+		"""Buckets the tasks matching query by an indexed key. A task in several
+		projects appears under each of them
+
+		:returns: dict of value (ids for entity fields) to list of Tasks
+		"""
+		self._check_keys([key])
+
+		groups = defaultdict(list)
+
+		for task in self.find(query):
+			for value in self._index_values(task._data)[key]:
+				groups[value].append(task)
+
+		return dict(groups)
+
+	def load_projects(self, projects, max_workers=8):
+		"""Fetches the tasks of many projects concurrently and adds them
+
+		:param projects: Project instances
+		:returns: number of tasks added
+		"""
+		projects = Entity.prefetch_children(projects, 'tasks', max_workers=max_workers)
+
+		return sum(self.add(project.tasks) for project in projects)
+
+	def apply_sync(self, state, result):
+		"""Applies what a SyncState.sync() call changed
+
+		:param state: the SyncState that was synced
+		:param result: the SyncResult it returned
+		"""
+		self.add(state.tasks[id] for id in result.added + result.changed)
+		self.remove(result.removed)
+
+	def _check_keys(self, keys):
+		unknown = [key for key in keys if key not in self.indexed]
+
+		if unknown:
+			raise EntityException('Cannot query task store on {0}, indexed keys are {1}'.format(
+				', '.join(unknown), ', '.join(sorted(self.indexed))))
+
+	@classmethod
+	def _index_values(cls, data):
+		"""
+		:param data: a task's _data, holding either raw dicts or wrapped
+			entities
+		:returns: dict of indexed key to the list of values it is indexed under
+		"""
+		values = {}
+
+		for key, field in cls.indexed.items():
+			value = data.get(field)
+
+			if key == 'project':
+				values[key] = [_ref(v) for v in value or []]
+			else:
+				values[key] = [_ref(value)]
+
+		return values
+
+	@staticmethod
+	def _wrap(task):
+		if isinstance(task, Task):
+			return task
+
+		return Task._from_data(task)
+
+
+class TaskStore(BaseTaskStore):
+	"""In-memory task store. Every indexed key maps values to sets of task
+	ids, modified_at is also kept sorted for range queries. The values each
+	task was indexed under are remembered, tasks changed in place just need
+	adding again"""
+
+	def __init__(self, tasks=None):
+		"""
+		:param tasks: optional tasks to add straight away
+		"""
+		self.clear()
+
+		if tasks:
+			self.add(tasks)
+
+	def add(self, tasks):
+		count = 0
+
+		for task in tasks:
+			task = self._wrap(task)
+
+			self._unindex(task.id)
+			self._tasks[task.id] = task
+			self._indexed[task.id] = values = self._index_values(task._data)
+
+			for key, keyValues in values.items():
+				for value in keyValues:
+					self._indexes[key][value].add(task.id)
+
+			bisect.insort(self._modified, (values['modified_at'][0], task.id))
+			count += 1
+
+		return count
+
+	def remove(self, ids):
+		for id in ids:
+			self._unindex(id)
+
+	def get(self, id):
+		return self._tasks.get(id)
+
+	def find(self, query=None):
+		query = query or {}
+		self._check_keys(query)
+
+		#intersect smallest first so the work is bounded by the most selective key
+		candidates = sorted((self._lookup(key, value) for key, value in query.items()), key=len)
+
+		if not candidates:
+			ids = self._tasks
+		else:
+			ids = candidates[0]
+
+			for other in candidates[1:]:
+				ids = ids & other
+
+		return [self._tasks[id] for id in sorted(ids)]
+
+	def clear(self):
+		self._tasks = {}
+		self._indexed = {}
+		self._indexes = dict((key, defaultdict(set)) for key in self.indexed)
+		self._modified = []
+
+	def __len__(self):
+		return len(self._tasks)
+
+	def _lookup(self, key, value):
+		if isinstance(value, Range):
+			if key != 'modified_at':
+				raise EntityException('Range queries are only supported on modified_at')
+
+			#None sorts before any string so it is skipped along with values
+			#before start
+			lo = bisect.bisect_left(self._modified, (value.start or '',))
+			ids = set()
+
+			for modified_at, id in self._modified[lo:]:
+				if value.end is not None and modified_at > value.end:
+					break
+
+				if modified_at is not None:
+					ids.add(id)
+
+			return ids
+
+		index = self._indexes[key]
+
+		if isinstance(value, (list, set, tuple)):
+			return set().union(*[index.get(_ref(v), ()) for v in value])
+
+		return set(index.get(_ref(value), ()))
+
+	def _unindex(self, id):
+		values = self._indexed.pop(id, None)
+
+		if values is None:
+			return
+
+		del self._tasks[id]
+
+		for key, keyValues in values.items():
+			index = self._indexes[key]
+
+			for value in keyValues:
+				index[value].discard(id)
+
+				if not index[value]:
+					del index[value]
+
+		pos = bisect.bisect_left(self._modified, (values['modified_at'][0], id))
+		del self._modified[pos]
+
+
+class SqliteTaskStore(SqliteConnection, BaseTaskStore):
+	"""Task store kept in a sqlite database, so it survives the script and
+	can be shared by several processes. Indexed keys are columns with sqlite
+	indexes on them and the full task is stored as JSON. Each thread and
+	process opens its own connection
+	"""
+
+	columns = ['assignee', 'created_by', 'completed', 'modified_at']
+
+	def __init__(self, path, timeout=30):
+		"""
+		:param path: database file, created if missing. ':memory:' only works
+			from a single thread
+		:param timeout: seconds to wait for another process holding a lock
+		"""
+		self.path = path
+		self.timeout = timeout
+
+		with self._connect() as conn:
+			conn.execute(
+				'CREATE TABLE IF NOT EXISTS tasks (id PRIMARY KEY, assignee, '
+				'created_by, completed, modified_at, data TEXT)')
+			conn.execute(
+				'CREATE TABLE IF NOT EXISTS task_projects ('
+				'task, project, PRIMARY KEY (task, project))')
+			conn.execute(
+				'CREATE INDEX IF NOT EXISTS task_projects_project ON task_projects (project)')
+
+			for column in self.columns:
+				conn.execute('CREATE INDEX IF NOT EXISTS tasks_{0} ON tasks ({0})'.format(column))
+
+	def add(self, tasks):
+		count = 0
+
+		with self._connect() as conn:
+			for task in tasks:
+				task = self._wrap(task)
+				values = self._index_values(task._data)
+
+				conn.execute(
+					'INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?)',
+					[task.id] + [values[c][0] for c in self.columns] +
+					[json.dumps(_to_json(task._data))])
+				conn.execute('DELETE FROM task_projects WHERE task = ?', (task.id,))
+				conn.executemany(
+					'INSERT OR IGNORE INTO task_projects VALUES (?, ?)',
+					[(task.id, project) for project in values['project'] if project is not None])
+				count += 1
+
+		return count
+
+	def remove(self, ids):
+		ids = [(id,) for id in ids]
+
+		with self._connect() as conn:
+			conn.executemany('DELETE FROM tasks WHERE id = ?', ids)
+			conn.executemany('DELETE FROM task_projects WHERE task = ?', ids)
+
+	def get(self, id):
+		row = self._connect().execute(
+			'SELECT data FROM tasks WHERE id = ?', (id,)).fetchone()
+
+		return Task._from_data(json.loads(row[0])) if row else None
+
+	def find(self, query=None):
+		query = query or {}
+		self._check_keys(query)
+
+		where = []
+		params = []
+
+		for key, value in query.items():
+			if key == 'project':
+				clause, args = self._condition('project', value)
+				where.append('id IN (SELECT task FROM task_projects WHERE {0})'.format(clause))
+			else:
+				clause, args = self._condition(key, value)
+				where.append(clause)
+
+			params.extend(args)
+
+		sql = 'SELECT data FROM tasks'
+
+		if where:
+			sql += ' WHERE ' + ' AND '.join(where)
+
+		return [
+			Task._from_data(json.loads(row[0]))
+			for row in self._connect().execute(sql + ' ORDER BY id', params)
+		]
+
+	def clear(self):
+		with self._connect() as conn:
+			conn.execute('DELETE FROM tasks')
+			conn.execute('DELETE FROM task_projects')
+
+	def __len__(self):
+		return self._connect().execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+	@staticmethod
+	def _condition(column, value):
+		"""
+		:returns: SQL clause and its params matching column against a query
+			value
+		"""
+		if isinstance(value, Range):
+			if column != 'modified_at':
+				raise EntityException('Range queries are only supported on modified_at')
+
+			clauses = ['modified_at IS NOT NULL']
+			params = []
+
+			if value.start is not None:
+				clauses.append('modified_at >= ?')
+				params.append(value.start)
+
+			if value.end is not None:
+				clauses.append('modified_at <= ?')
+				params.append(value.end)
+
+			return ' AND '.join(clauses), params
+
+		if isinstance(value, (list, set, tuple)):
+			values = [_ref(v) for v in value]
+			clauses = []
+
+			if None in values:
+				values = [v for v in values if v is not None]
+				clauses.append('{0} IS NULL'.format(column))
+
+			if values:
+				clauses.append('{0} IN ({1})'.format(column, ', '.join('?' * len(values))))
+
+			return '({0})'.format(' OR '.join(clauses or ['0'])), values
+
+		value = _ref(value)
+
+		if value is None:
+			return '{0} IS NULL'.format(column), []
+
+		return '{0} = ?'.format(column), [value]
+
+
+def _ref(value):
+	"""Reduces a field value to what it is indexed under, the id for entities
+	and compact entity dicts"""
+	if isinstance(value, Entity):
+		return value.id
+
+	if isinstance(value, dict):
+		return value.get('id')
+
+	return value
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+from datetime import datetime, timedelta
+
+from entities import Task
+from entities.entity import _to_json
+
+
+class SyncResult(object):
+	"""Ids of the tasks that changed during one sync"""
+
+	def __init__(self):
+		self.added = []
+		self.changed = []
+		self.removed = []
+
+	def __nonzero__(self):
+		return bool(self.added or self.changed or self.removed)
+
+	def __repr__(self):
+		return 'SyncResult(added={0}, changed={1}, removed={2})'.format(
+			self.added, self.changed, self.removed)
+
+
+class SyncState(object):
+	"""Local copy of a project's tasks that is kept up to date incrementally.
+	After the first sync only tasks modified since the previous sync are
+	requested. Deleted tasks or tasks moved out of the project never show up
+	in an incremental sync so a full sync should be run now and then to find
+	removals. Changes are detected against the modified_at recorded per task,
+	not the Task instances, which an identity map updates in place
+	"""
+
+	#seconds subtracted from the high-water mark to allow for clock skew
+	#between this machine and the API
+	skew = 60
+
+	def __init__(self, since=None, tasks=None, modified=None):
+		"""
+		:param since: ISO 8601 time of the last sync, None to start with a
+			full sync
+		:param tasks: dict of task id to Task already synced
+		:param modified: dict of task id to the modified_at last synced,
+			taken from tasks when not given
+		"""
+		self.since = since
+		self.tasks = tasks or {}
+
+		if modified is None:
+			modified = dict(
+				(id, task._data.get('modified_at')) for id, task in self.tasks.items())
+
+		self.modified = modified
+
+	def sync(self, project, full=False, page_size=None):
+		"""Fetches the tasks in project changed since the last sync and merges
+		them into tasks
+
+		:param project: Project or project id to sync
+		:param full: if true fetch every task, which also detects removals
+		:param page_size: number of tasks requested per page
+		:returns: SyncResult
+		"""
+		started = datetime.utcnow() - timedelta(seconds=self.skew)
+		query = {'project': getattr(project, 'id', project)}
+
+		if self.since and not full:
+			query['modified_since'] = self.since
+
+		result = SyncResult()
+		seen = set()
+
+		for task in Task.find_iter(query, page_size):
+			seen.add(task.id)
+			modified_at = task._data.get('modified_at')
+
+			if task.id not in self.modified:
+				result.added.append(task.id)
+			elif self.modified[task.id] != modified_at:
+				result.changed.append(task.id)
+			else:
+				continue
+
+			self.tasks[task.id] = task
+			self.modified[task.id] = modified_at
+
+		if full or not self.since:
+			for id in set(self.tasks) - seen:
+				del self.tasks[id]
+				self.modified.pop(id, None)
+				result.removed.append(id)
+
+		self.since = started.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+		return result
+
+	def save(self, path):
+		"""Writes the state to a JSON file so the next run can continue from it"""
+		with open(path, 'w') as f:
+			json.dump({
+				'since': self.since,
+				'tasks': [_to_json(task) for task in self.tasks.values()],
+				'modified': self.modified.items()
+			}, f)
+
+	@classmethod
+	def load(cls, path):
+		"""Reads a state written by save()"""
+		with open(path) as f:
+			state = json.load(f)
+
+		#files written before modified was saved fall back to the tasks
+		modified = state.get('modified')
+
+		return cls(state['since'], dict(
+			(data['id'], Task(data)) for data in state['tasks']
+		), dict(modified) if modified is not None else None)
+
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measures how fast entities are built from API payloads
+
+Run from the base of the repo: python bench/construction.py [count]
+"""
+
+import json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from asana import Task
+
+
+def task_payload(i):
+	"""A task dict shaped like a full Task.find result"""
+	return {
+		'id': i,
+		'name': 'Task %i' % i,
+		'notes': 'Some notes',
+		'completed': False,
+		'completed_at': None,
+		'created_at': '2015-01-01T00:00:00.000Z',
+		'modified_at': '2015-01-02T00:00:00.000Z',
+		'assignee': {'id': i % 50, 'name': 'User %i' % (i % 50)},
+		'created_by': {'id': i % 20, 'name': 'User %i' % (i % 20)},
+		'followers': [{'id': 1, 'name': 'User 1'}, {'id': 2, 'name': 'User 2'}],
+		'projects': [{'id': 7, 'name': 'Project'}],
+		'parent': None,
+		'workspace': {'id': 3, 'name': 'Workspace'}
+	}
+
+
+def main(count=10000, repeat=5):
+	encoded = json.dumps([task_payload(i) for i in range(count)])
+	best = None
+
+	for _ in range(repeat):
+		#entities keep the dicts they're given so build from fresh copies
+		payloads = json.loads(encoded)
+
+		start = time.time()
+		for data in payloads:
+			Task(data)
+		elapsed = time.time() - start
+
+		best = elapsed if best is None else min(best, elapsed)
+
+	print 'construct {0} tasks: {1:.3f}s ({2:.0f} tasks/s)'.format(
+		count, best, count / best)
+
+
+if __name__ == '__main__':
+	main(*map(int, sys.argv[1:2]))
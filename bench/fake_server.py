@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A local stand-in for the Asana API used by the benchmarks. It serves a
+generated workspace of users, projects and tasks from memory and supports
+pagination, opt_fields, the batch endpoint, added latency and randomly
+injected 429 responses
+"""
+
+import json, multiprocessing, random, re, threading, time
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import urlparse, parse_qs
+
+
+class Dataset(object):
+	"""Generated workspace contents"""
+
+	def __init__(self, projects=10, tasks_per_project=500, users=50, section_every=0):
+		"""
+		:param section_every: if set every nth task of a project is a section
+		"""
+		self.workspace = {'id': 1, 'name': 'Workspace', 'is_organization': False}
+		self.users = dict((i, {
+			'id': i, 'name': 'User %i' % i, 'email': 'user%i@example.com' % i,
+			'workspaces': [{'id': 1, 'name': 'Workspace'}]
+		}) for i in range(100, 100 + users))
+		self.projects = {}
+		self.tasks = {}
+		self.project_tasks = {}
+
+		user_ids = sorted(self.users)
+		task_id = 100000
+
+		for p in range(1000, 1000 + projects):
+			self.projects[p] = {
+				'id': p, 'name': 'Project %i' % p, 'notes': '',
+				'workspace': {'id': 1, 'name': 'Workspace'}, 'team': None
+			}
+			self.project_tasks[p] = []
+
+			for n in range(tasks_per_project):
+				task_id += 1
+				is_section = section_every and n % section_every == 0
+				assignee = self.compact_user(user_ids[task_id % len(user_ids)])
+				creator = self.compact_user(user_ids[(task_id * 7) % len(user_ids)])
+
+				self.tasks[task_id] = {
+					'id': task_id,
+					'name': ('Section %i:' if is_section else 'Task %i') % task_id,
+					'assignee': assignee,
+					'created_by': creator,
+					'created_at': '2015-01-01T00:00:00.000Z',
+					'completed': n % 3 == 0,
+					'completed_at': '2015-02-01T00:00:00.000Z' if n % 3 == 0 else None,
+					'followers': [assignee, creator],
+					'modified_at': '2015-03-%02dT00:00:00.000Z' % (n % 28 + 1),
+					'notes': 'Notes for task %i' % task_id,
+					'projects': [{'id': p, 'name': 'Project %i' % p}],
+					'parent': None,
+					'workspace': {'id': 1, 'name': 'Workspace'}
+				}
+				self.project_tasks[p].append(task_id)
+
+	def compact_user(self, id):
+		return {'id': id, 'name': self.users[id]['name']}
+
+
+class FakeAsanaServer(ThreadingMixIn, HTTPServer):
+	"""Threaded HTTP server answering a subset of the Asana API
+
+		server = FakeAsanaServer(Dataset(), latency=0.01)
+		server.start()
+		api.aurl = server.url
+	"""
+
+	daemon_threads = True
+	#the default of 5 overflows with a few concurrent clients, dropped SYNs
+	#are retried after a second which swamps any timing
+	request_queue_size = 128
+
+	def __init__(self, dataset, latency=0, rate_limit_probability=0, port=0):
+		"""
+		:param latency: seconds added to every response
+		:param rate_limit_probability: chance of answering any request with
+			a 429
+		:param port: port to listen on, 0 picks a free one
+		"""
+		HTTPServer.__init__(self, ('127.0.0.1', port), FakeAsanaHandler)
+		self.dataset = dataset
+		self.latency = latency
+		self.rate_limit_probability = rate_limit_probability
+		self.lock = threading.Lock()
+		self.request_count = 0
+		self.next_id = 900000
+
+	@property
+	def url(self):
+		return 'http://127.0.0.1:%i/api/1.0' % self.server_address[1]
+
+	def start(self):
+		thread = threading.Thread(target=self.serve_forever)
+		thread.daemon = True
+		thread.start()
+
+		return self
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+
+class FakeAsanaProcess(object):
+	"""Runs a FakeAsanaServer in a child process so it doesn't compete with
+	the client being measured for the GIL. The dataset is copied into the
+	child, changes made through the API aren't visible in self.dataset
+
+		server = FakeAsanaProcess(Dataset(), latency=0.01).start()
+		api.aurl = server.url
+	"""
+
+	def __init__(self, dataset, latency=0, rate_limit_probability=0, port=0):
+		"""
+		:param: see FakeAsanaServer
+		"""
+		self.dataset = dataset
+		self.options = {
+			'latency': latency, 'rate_limit_probability': rate_limit_probability,
+			'port': port
+		}
+		self.process = None
+		self.port = None
+
+	@property
+	def url(self):
+		return 'http://127.0.0.1:%i/api/1.0' % self.port
+
+	def start(self):
+		parent, child = multiprocessing.Pipe()
+
+		self.process = multiprocessing.Process(
+			target=_serve, args=(child, self.dataset, self.options))
+		self.process.daemon = True
+		self.process.start()
+		self.port = parent.recv()
+
+		return self
+
+	def stop(self):
+		self.process.terminate()
+		self.process.join()
+
+
+def _serve(conn, dataset, options):
+	server = FakeAsanaServer(dataset, **options)
+	conn.send(server.server_address[1])
+	server.serve_forever()
+
+
+class FakeAsanaHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	#write each response in one go, unbuffered headers plus Nagle add ~40ms
+	wbufsize = -1
+	disable_nagle_algorithm = True
+
+	routes = [
+		('GET', r'^projects$', 'list_projects'),
+		('GET', r'^projects/(\d+)$', 'get_project'),
+		('GET', r'^projects/(\d+)/tasks$', 'project_tasks'),
+		('GET', r'^tasks$', 'find_tasks'),
+		('POST', r'^tasks$', 'create_task'),
+		('GET', r'^tasks/(\d+)$', 'get_task'),
+		('PUT', r'^tasks/(\d+)$', 'update_task'),
+		('POST', r'^tasks/(\d+)/(addProject|removeProject)$', 'edit_project'),
+		('GET', r'^tasks/(\d+)/tags$', 'task_tags'),
+		('GET', r'^users/(\d+|me)$', 'get_user'),
+		('GET', r'^workspaces/(\d+)$', 'get_workspace'),
+		('POST', r'^batch$', 'batch'),
+	]
+
+	def do_GET(self):
+		self.handle_method('GET')
+
+	def do_POST(self):
+		self.handle_method('POST')
+
+	def do_PUT(self):
+		self.handle_method('PUT')
+
+	def do_DELETE(self):
+		self.handle_method('DELETE')
+
+	def log_message(self, format, *args):
+		pass
+
+	def handle_method(self, method):
+		server = self.server
+
+		with server.lock:
+			server.request_count += 1
+
+		if server.latency:
+			time.sleep(server.latency)
+
+		url = urlparse(self.path)
+		query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+		body = None
+
+		length = int(self.headers.get('content-length') or 0)
+		if length:
+			body = json.loads(self.rfile.read(length)).get('data')
+
+		if random.random() < server.rate_limit_probability:
+			return self.respond(429, {'errors': [{'message': 'Rate limited'}]},
+				{'Retry-After': '1'})
+
+		status, payload = self.dispatch(method, url.path, query, body)
+		self.respond(status, payload)
+
+	def dispatch(self, method, path, query, body):
+		path = re.sub(r'^/api/1\.0/', '', path).strip('/')
+
+		for route_method, pattern, name in self.routes:
+			match = re.match(pattern, path)
+
+			if route_method == method and match:
+				return getattr(self, name)(query, body, *match.groups())
+
+		return 404, {'errors': [{'message': 'Not found: %s %s' % (method, path)}]}
+
+	def respond(self, status, payload, headers=None):
+		content = json.dumps(payload)
+
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json; charset=UTF-8')
+		self.send_header('Content-Length', str(len(content)))
+		for key, value in (headers or {}).items():
+			self.send_header(key, value)
+		self.end_headers()
+		self.wfile.write(content)
+
+	def collection(self, items, query):
+		"""Projects and paginates a list of items like the API does"""
+		items = [self.project_fields(item, query) for item in items]
+
+		if 'limit' not in query:
+			return 200, {'data': items}
+
+		limit = int(query['limit'])
+		offset = int(query.get('offset') or 0)
+		page = items[offset:offset + limit]
+		next_page = None
+
+		if offset + limit < len(items):
+			next_page = {'offset': str(offset + limit)}
+
+		return 200, {'data': page, 'next_page': next_page}
+
+	def item(self, item, query):
+		if item is None:
+			return 404, {'errors': [{'message': 'Not found'}]}
+
+		return 200, {'data': self.project_fields(item, query)}
+
+	@staticmethod
+	def project_fields(item, query):
+		"""Applies opt_fields, only top level names are honoured"""
+		if not query.get('opt_fields'):
+			return item
+
+		fields = set(f.split('.')[0] for f in query['opt_fields'].split(','))
+		fields.add('id')
+
+		return dict((k, v) for k, v in item.items() if k in fields)
+
+	def list_projects(self, query, body):
+		projects = self.server.dataset.projects
+
+		return self.collection([projects[id] for id in sorted(projects)], query)
+
+	def get_project(self, query, body, id):
+		return self.item(self.server.dataset.projects.get(int(id)), query)
+
+	def project_tasks(self, query, body, id):
+		dataset = self.server.dataset
+		ids = dataset.project_tasks.get(int(id), [])
+
+		return self.collection([dataset.tasks[t] for t in ids], query)
+
+	def find_tasks(self, query, body):
+		dataset = self.server.dataset
+		ids = dataset.project_tasks.get(int(query.get('project', 0)), [])
+		tasks = [dataset.tasks[t] for t in ids]
+
+		if query.get('modified_since'):
+			tasks = [t for t in tasks if t['modified_at'] >= query['modified_since']]
+
+		return self.collection(tasks, query)
+
+	def create_task(self, query, body):
+		with self.server.lock:
+			self.server.next_id += 1
+			task = dict(body, id=self.server.next_id)
+
+		self.server.dataset.tasks[task['id']] = task
+
+		return 201, {'data': task}
+
+	def get_task(self, query, body, id):
+		return self.item(self.server.dataset.tasks.get(int(id)), query)
+
+	def update_task(self, query, body, id):
+		task = self.server.dataset.tasks.get(int(id))
+
+		if task is None:
+			return 404, {'errors': [{'message': 'Not found'}]}
+
+		task.update(body or {})
+
+		return 200, {'data': task}
+
+	def edit_project(self, query, body, id, operation):
+		dataset = self.server.dataset
+		ids = dataset.project_tasks.setdefault(int(body['project']), [])
+		id = int(id)
+
+		with self.server.lock:
+			if id in ids:
+				ids.remove(id)
+
+			if operation == 'addProject':
+				if body.get('insert_after') and int(body['insert_after']) in ids:
+					ids.insert(ids.index(int(body['insert_after'])) + 1, id)
+				elif body.get('insert_before') and int(body['insert_before']) in ids:
+					ids.insert(ids.index(int(body['insert_before'])), id)
+				else:
+					ids.append(id)
+
+		return 200, {'data': {}}
+
+	def task_tags(self, query, body, id):
+		return self.collection([], query)
+
+	def get_user(self, query, body, id):
+		users = self.server.dataset.users
+		user = users[min(users)] if id == 'me' else users.get(int(id))
+
+		return self.item(user, query)
+
+	def get_workspace(self, query, body, id):
+		return self.item(self.server.dataset.workspace, query)
+
+	def batch(self, query, body):
+		responses = []
+
+		for action in body['actions']:
+			path = action['relative_path']
+			status, payload = self.dispatch(
+				action['method'].upper(), path, action.get('options') or {},
+				action.get('data'))
+			responses.append({'status_code': status, 'body': payload, 'headers': {}})
+
+		return 200, {'data': responses}
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Runs the benchmark scenarios against a local fake Asana server
+
+Run from the base of the repo:
+
+	python bench/run.py                       # all scenarios
+	python bench/run.py -s find -s children   # scenarios whose name contains
+	python bench/run.py --json > before.json  # machine readable results
+	python bench/run.py --compare before.json # show change against a run
+"""
+
+import argparse, json, os, sys, time
+
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + "/../")
+
+from asana import AsanaAPI, Entity, LayoutPlan, Project, RequestStats, Section, Task
+
+import construction
+from fake_server import Dataset, FakeAsanaProcess, FakeAsanaServer
+
+SCENARIOS = OrderedDict()
+
+
+def scenario(fn):
+	SCENARIOS[fn.__name__] = fn
+	return fn
+
+
+class Context(object):
+	"""What a scenario needs: the server, its dataset and a way to make a
+	fresh api pointed at it"""
+
+	def __init__(self, server, options):
+		self.server = server
+		self.dataset = server.dataset
+		self.options = options
+		self.stats = None
+		self.apis = []
+
+	def api(self, **kwargs):
+		"""Builds an api talking to the fake server, sets it on Entity and
+		records its requests in self.stats"""
+		kwargs.setdefault('pool_maxsize', self.options.workers)
+		api = AsanaAPI('key', **kwargs)
+		api.aurl = self.server.url
+
+		self.stats = RequestStats()
+		api.add_hook('after', self.stats)
+
+		Entity.set_api(api)
+		self.apis.append(api)
+
+		return api
+
+	def close(self):
+		for api in self.apis:
+			api.close()
+
+	@property
+	def project_ids(self):
+		return sorted(self.dataset.projects)
+
+	@property
+	def task_ids(self):
+		return sorted(self.dataset.tasks)[:self.options.items]
+
+
+def timed(fn):
+	start = time.time()
+	fn()
+	return time.time() - start
+
+
+@scenario
+def construct_tasks(ctx):
+	"""Building Task entities from full payloads, no I/O"""
+	count = ctx.options.items * 10
+	payloads = json.loads(json.dumps(
+		[construction.task_payload(i) for i in range(count)]))
+
+	ctx.stats = None
+
+	return count, timed(lambda: [Task(data) for data in payloads])
+
+
+@scenario
+def find_large_project(ctx):
+	"""Task.find over the largest project in one response"""
+	ctx.api()
+	project = ctx.project_ids[0]
+
+	return len(ctx.dataset.project_tasks[project]), timed(
+		lambda: Task.find({'project': project}))
+
+
+@scenario
+def find_iter_large_project(ctx):
+	"""Task.find_iter over the same project, page by page"""
+	ctx.api()
+	project = ctx.project_ids[0]
+
+	return len(ctx.dataset.project_tasks[project]), timed(
+		lambda: list(Task.find_iter({'project': project})))
+
+
+@scenario
+def find_projected(ctx):
+	"""Task.find requesting only name and completed"""
+	ctx.api()
+	project = ctx.project_ids[0]
+
+	return len(ctx.dataset.project_tasks[project]), timed(
+		lambda: Task.find({'project': project}, fields=['name', 'completed']))
+
+
+@scenario
+def children_serial(ctx):
+	"""project.tasks for every project, one after another"""
+	ctx.api()
+	projects = [Project({'id': id}) for id in ctx.project_ids]
+
+	return len(projects), timed(lambda: [p.tasks for p in projects])
+
+
+@scenario
+def children_prefetch(ctx):
+	"""Entity.prefetch_children for every project"""
+	ctx.api()
+	projects = [Project({'id': id}) for id in ctx.project_ids]
+
+	return len(projects), timed(lambda: Entity.prefetch_children(
+		projects, 'tasks', max_workers=ctx.options.workers))
+
+
+@scenario
+def load_uncached(ctx):
+	"""Task.load for many tasks without a cache"""
+	ctx.api()
+	tasks = [Task({'id': id}) for id in ctx.task_ids]
+
+	return len(tasks), timed(lambda: [t.load() for t in tasks])
+
+
+@scenario
+def load_cached(ctx):
+	"""Task.load for many tasks answered from a warm cache"""
+	ctx.api(cache=True)
+
+	for id in ctx.task_ids:
+		Task({'id': id}).load()
+
+	ctx.stats.reset()
+	tasks = [Task({'id': id}) for id in ctx.task_ids]
+
+	return len(tasks), timed(lambda: [t.load() for t in tasks])
+
+
+@scenario
+def load_many(ctx):
+	"""Task.load_many for many tasks"""
+	ctx.api()
+	tasks = [Task({'id': id}) for id in ctx.task_ids]
+
+	return len(tasks), timed(lambda: Task.load_many(
+		tasks, max_workers=ctx.options.workers))
+
+
+@scenario
+def load_shared(ctx):
+	"""Task.load_many where many entities refer to a few tasks, as when
+	workers resolve the same project or workspace"""
+	ctx.api()
+	ids = ctx.task_ids[:4]
+	tasks = [Task({'id': ids[i % len(ids)]}) for i in range(ctx.options.items)]
+
+	return len(tasks), timed(lambda: Task.load_many(
+		tasks, max_workers=ctx.options.workers))
+
+
+def _dirty_tasks(ctx):
+	tasks = [Task({'id': id}) for id in ctx.task_ids]
+
+	for task in tasks:
+		task.notes = 'Updated at %f' % time.time()
+
+	return tasks
+
+
+@scenario
+def save_serial(ctx):
+	"""Saving many updated tasks one request each"""
+	ctx.api()
+	tasks = _dirty_tasks(ctx)
+
+	return len(tasks), timed(lambda: [t.save() for t in tasks])
+
+
+@scenario
+def save_batched(ctx):
+	"""Saving many updated tasks through the batch endpoint"""
+	api = ctx.api()
+	tasks = _dirty_tasks(ctx)
+
+	def save():
+		with api.batch():
+			for task in tasks:
+				task.save()
+
+	return len(tasks), timed(save)
+
+
+@scenario
+def save_session(ctx):
+	"""Saving many updated tasks in an api.session(), sent concurrently"""
+	api = ctx.api()
+	tasks = _dirty_tasks(ctx)
+
+	def save():
+		with api.session(max_workers=ctx.options.workers):
+			for task in tasks:
+				task.save()
+
+	return len(tasks), timed(save)
+
+
+def _layout(ctx, project):
+	"""Every 10th of the project's first tasks becomes a section header with
+	the 9 tasks after it reversed"""
+	ids = ctx.dataset.project_tasks[project][:ctx.options.items]
+
+	return [(ids[i], ids[i + 1:i + 10][::-1]) for i in range(0, len(ids), 10)]
+
+
+@scenario
+def reorganize_serial(ctx):
+	"""Moving tasks into sections one add_to_section call at a time"""
+	ctx.api()
+	project = ctx.project_ids[1]
+	layout = _layout(ctx, project)
+
+	def move():
+		for section, tasks in layout:
+			for id in reversed(tasks):
+				Task({'id': id}).add_to_section(Section({'id': section}), project)
+
+	return sum(len(tasks) for _, tasks in layout), timed(move)
+
+
+@scenario
+def reorganize_plan(ctx):
+	"""The same reorganization run as a LayoutPlan"""
+	ctx.api()
+	project = ctx.project_ids[2]
+	layout = _layout(ctx, project)
+
+	return sum(len(tasks) for _, tasks in layout), timed(lambda: LayoutPlan(
+		project, layout).execute(max_workers=ctx.options.workers))
+
+
+def run(names, options):
+	dataset = Dataset(
+		projects=options.projects, tasks_per_project=options.tasks,
+		section_every=options.section_every)
+	server = (FakeAsanaServer if options.in_process else FakeAsanaProcess)(
+		dataset, latency=options.latency,
+		rate_limit_probability=options.rate_limit_probability).start()
+
+	results = OrderedDict()
+
+	try:
+		for name in names:
+			ctx = Context(server, options)
+
+			try:
+				ops, seconds = SCENARIOS[name](ctx)
+			finally:
+				ctx.close()
+
+			result = {'ops': ops, 'seconds': seconds, 'ops_per_second': ops / seconds}
+
+			if ctx.stats:
+				report = ctx.stats.report()
+				result['requests'] = sum(
+					r['count'] - r['cache_hits'] - r['coalesced'] for r in report)
+				result['p50_ms'] = max(r['p50'] for r in report) * 1000
+				result['p95_ms'] = max(r['p95'] for r in report) * 1000
+
+			results[name] = result
+	finally:
+		server.stop()
+
+	return results
+
+
+def print_results(results, baseline=None):
+	row = '{0:<25} {1:>7} {2:>9} {3:>11} {4:>9} {5:>8} {6:>8} {7:>8}'
+
+	print row.format('SCENARIO', 'OPS', 'SECONDS', 'OPS/S', 'REQUESTS',
+		'P50 MS', 'P95 MS', 'CHANGE')
+
+	for name, result in results.items():
+		change = ''
+
+		if baseline and name in baseline:
+			before = baseline[name]['ops_per_second']
+			change = '%+.0f%%' % ((result['ops_per_second'] / before - 1) * 100)
+
+		print row.format(
+			name, result['ops'], '%.3f' % result['seconds'],
+			'%.0f' % result['ops_per_second'], result.get('requests', '-'),
+			'%.1f' % result['p50_ms'] if 'p50_ms' in result else '-',
+			'%.1f' % result['p95_ms'] if 'p95_ms' in result else '-',
+			change)
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Benchmark the library against a local fake Asana server',
+		formatter_class=argparse.ArgumentDefaultsHelpFormatter
+	)
+	parser.add_argument('--scenario', '-s', action='append',
+		help='Only run scenarios whose name contains this, can be repeated')
+	parser.add_argument('--projects', type=int, default=10, help='Projects in the dataset')
+	parser.add_argument('--tasks', type=int, default=2000, help='Tasks per project')
+	parser.add_argument('--items', type=int, default=200,
+		help='Entities loaded or saved by the per-item scenarios')
+	parser.add_argument('--section-every', type=int, default=0,
+		help='Make every nth task a section')
+	parser.add_argument('--latency', type=float, default=0.005,
+		help='Seconds the server waits before every response')
+	parser.add_argument('--rate-limit-probability', type=float, default=0,
+		help='Chance the server answers a request with a 429')
+	parser.add_argument('--workers', type=int, default=8,
+		help='Concurrency for the parallel scenarios')
+	parser.add_argument('--in-process', action='store_true',
+		help='Run the server in this process instead of a child process')
+	parser.add_argument('--json', action='store_true', help='Print results as JSON')
+	parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+
+	options = parser.parse_args()
+
+	names = [
+		name for name in SCENARIOS
+		if not options.scenario or any(s in name for s in options.scenario)
+	]
+
+	results = run(names, options)
+
+	if options.json:
+		print json.dumps(results, indent=2)
+	else:
+		baseline = None
+
+		if options.compare:
+			with open(options.compare) as f:
+				baseline = json.load(f)
+
+		print_results(results, baseline)
+
+
+if __name__ == '__main__':
+	main()
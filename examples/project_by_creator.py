@@ -1,8 +1,8 @@
 #! /usr/bin/python
 
-from asana import Entity, AsanaAPI, Project, Section
+from asana import Entity, AsanaAPI, IdentityMap, LayoutPlan, Project, Section, TaskStore
 
-import re, argparse
+import re, argparse, sys
 
 #argument parsing
 parser = argparse.ArgumentParser(
@@ -17,16 +17,17 @@ options = parser.parse_args()
 
 Entity.set_api(AsanaAPI(options.api_key, debug=True, cache=True))
 
+#share one instance per creator so each creator's name is loaded only once
+Entity.set_identity_map(IdentityMap())
+
 print 'Loading projects and tasks...'
 
 projects = Project.find({
 	'name': lambda n: re.search(options.project_regex, n)
 })
 
-tasks = []
-
-for project in projects:
-	tasks.extend(project.tasks)
+store = TaskStore()
+store.load_projects(projects)
 
 print 'Creating view project...'
 
@@ -38,23 +39,29 @@ view_project = Project({
 
 view_project.save()
 
+tasks_by_creator = store.group_by('created_by')
+
+print 'Creating sections...'
 
-#initialize each creator to an empty array
-tasks_by_creator = {t.created_by: [] for t in tasks}
+layout = []
 
-print 'Adding tasks to meeting...'
+for creator, tasks in tasks_by_creator.items():
+	# tasks without a creator are grouped under None
+	name = tasks[0].created_by.name if creator is not None else 'No creator'
 
-for task in tasks:
-	tasks_by_creator[task.created_by].append(task)
+	section = Section({'name':name + ':'})
 
-for creator in tasks_by_creator.keys():
+	view_project.add_task(section)
 
-	for task in tasks_by_creator[creator]:
-		view_project.add_task(task)
+	layout.append((section, tasks))
 
-	# need to add section after tasks to correct order
-	section = Section({'name':creator.name + ':'})
+print 'Adding tasks to view...'
 
-	view_project.add_task(section)
+def report(done, total):
+	sys.stdout.write('\r{0}/{1}'.format(done, total))
+	sys.stdout.flush()
+
+# each section's tasks are added in order while sections are filled concurrently
+LayoutPlan(view_project, layout).execute(progress=report)
 
-print 'Done!'
\ No newline at end of file
+print '\nDone!'
\ No newline at end of file
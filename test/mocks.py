@@ -1,3 +1,5 @@
+import json
+from io import BytesIO
 from functools import partial
 
 class ApiMock():
@@ -16,3 +18,38 @@ class ApiMock():
 		self.requests.append((method, target, kwargs))
 
 		return {}
+
+class ResponseMock():
+	"""Mock a requests response carrying a JSON body"""
+
+	def __init__(self, body=None, status_code=200, headers=None):
+		self.status_code = status_code
+		self.headers = {'content-type': 'application/json; charset=UTF-8'}
+		self.headers.update(headers or {})
+		self.text = json.dumps(body if body is not None else {'data': {}})
+		self.content = self.text
+		self.raw = BytesIO(self.content)
+		self.closed = False
+
+	def close(self):
+		self.closed = True
+
+class SessionMock():
+	"""Mock a requests.Session by saving all calls and replaying queued
+	responses. Once the queue is empty an empty data response is returned"""
+
+	def __init__(self, responses=None):
+		self.requests = []
+		self.responses = list(responses or [])
+		self.closed = False
+
+	def request(self, method, url, **kwargs):
+		self.requests.append((method, url, kwargs))
+
+		if self.responses:
+			return self.responses.pop(0)
+
+		return ResponseMock()
+
+	def close(self):
+		self.closed = True
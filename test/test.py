@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import os, sys, unittest, re
+import os, sys, unittest, re, time, json, threading, shutil, tempfile
 
 asanadir = os.path.dirname(os.path.realpath(__file__))+"/../"
 sys.path.insert(0, asanadir)
@@ -9,7 +9,20 @@ asana =  __import__('asana')
 
 from asana import *
 
-from mocks import ApiMock
+from io import BytesIO
+from mocks import ApiMock, SessionMock, ResponseMock
+
+try:
+	import ijson
+except ImportError:
+	ijson = None
+
+def temp_path(test, name):
+	"""A path in a new temporary directory removed once test finishes"""
+	directory = tempfile.mkdtemp()
+	test.addCleanup(shutil.rmtree, directory)
+
+	return os.path.join(directory, name)
 
 class BaseTest(unittest.TestCase):
 	def setUp(self):
@@ -77,6 +90,192 @@ class EntityTest(BaseTest):
 
 		self.assertEqual(Task.from_link(None), None)
 
+	def test_matchon_dispatch(self):
+		"""Field names are mapped to wrapper classes once and memoized"""
+		self.assertIs(Entity._get_match('assignee'), User)
+		self.assertIs(Entity._get_match('created_by'), User)
+		self.assertIs(Entity._get_match('workspace'), Workspace)
+		self.assertIs(Entity._get_match('assignee_status'), None)
+		self.assertIn('assignee_status', Entity._match_cache)
+
+		task = Task({'id': 1, 'followers': [{'id': 2}], 'projects': [{'id': 3}]})
+		self.assertIsInstance(task.followers[0], User)
+		self.assertIsInstance(task.projects[0], Project)
+
+	def test_lazy_wrapping(self):
+		"""Nested values stay raw until accessed, then are wrapped once"""
+		task = Task({'id': 1, 'assignee': {'id': 2}, 'followers': [{'id': 3}]})
+
+		self.assertEqual(task._data['assignee'], {'id': 2})
+		self.assertEqual(task._data['followers'], [{'id': 3}])
+
+		self.assertIsInstance(task.assignee, User)
+		self.assertIs(task.assignee, task.assignee)
+		self.assertIs(task.followers[0], task.followers[0])
+
+	def test_identity_map(self):
+		Entity.set_identity_map(IdentityMap())
+
+		try:
+			tasks = Task._build_result({}, [
+				{'id': 1, 'name': 'a', 'created_by': {'id': 5}},
+				{'id': 2, 'name': 'b', 'created_by': {'id': 5, 'name': 'Bob'}},
+				{'id': 3, 'name': 'c', 'created_by': {'id': 6}}
+			])
+
+			self.assertIs(tasks[0].created_by, tasks[1].created_by)
+			self.assertIsNot(tasks[0].created_by, tasks[2].created_by)
+			self.assertEqual(tasks[0].created_by.name, 'Bob')
+
+			#unsaved local changes survive a refresh from the API
+			tasks[0].name = 'local'
+			again = Task._build_result({}, [{'id': 1, 'name': 'a', 'notes': 'n'}])[0]
+			self.assertIs(again, tasks[0])
+			self.assertEqual((again.name, again.notes), ('local', 'n'))
+		finally:
+			Entity.set_identity_map(None)
+
+		self.assertIsNot(Task._from_data({'id': 1}), Task._from_data({'id': 1}))
+
+	def test_load_many(self):
+		tasks = [
+			Task({'id': 1}),
+			Task({'id': 2, 'name': 'b', 'notes': 'n'}),
+			Task({'id': 3, 'name': 'c'})
+		]
+
+		Task.load_many(tasks, fields=['name', 'notes'], max_workers=2)
+
+		self.assertEqual(
+			sorted((r[1], r[2]['params']['opt_fields']) for r in self.api.requests),
+			[('tasks/1', 'name,notes'), ('tasks/3', 'name,notes')]
+		)
+
+	def test_load_siblings(self):
+		Task.load_siblings = True
+
+		try:
+			tasks = Task._build_result({}, [
+				{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, {'id': 3, 'name': 'c', 'notes': 'n'}
+			])
+			tasks[0].notes
+		except KeyError:
+			#the mock api returns no data
+			pass
+		finally:
+			Task.load_siblings = False
+
+		self.assertEqual(sorted(r[1] for r in self.api.requests), ['tasks/1', 'tasks/2'])
+
+	def test_field_projection(self):
+		Task.find({'project': 1}, fields=['completed', 'assignee.name'])
+		Project({'id': 2}).get_subitem(Task, fields=['name'])
+		Task({'id': 3}).load(fields=['notes'])
+
+		self.assertEqual(self.api.requests, [
+			('get', 'tasks', {'params': {'project': 1, 'opt_fields': 'completed,assignee.name,name'}}),
+			('get', 'projects/2/tasks', {'params': {'opt_fields': 'name'}}),
+			('get', 'tasks/3', {'params': {'opt_fields': 'notes'}})
+		])
+
+	def test_projection_includes_local_filters(self):
+		api = AsanaAPI('key')
+		api.http_session = SessionMock([ResponseMock({'data': [
+			{'id': 1, 'name': 'a', 'completed': False},
+			{'id': 2, 'name': 'b', 'completed': True}
+		]})])
+		Entity.set_api(api)
+
+		tasks = Task.find({'project': 5, 'completed': False}, fields=['name'])
+
+		self.assertEqual([t.id for t in tasks], [1])
+		self.assertEqual(api.http_session.requests[0][2]['params']['opt_fields'],
+			'name,completed')
+
+	def test_unrequested_field_loads_on_access(self):
+		task = Task._build_result({}, [{'id': 1, 'name': 'a', 'assignee': {'id': 2, 'name': 'b'}}])[0]
+
+		self.assertEqual(task.assignee.name, 'b')
+		self.assertEqual(self.api.requests, [])
+
+		try:
+			task.notes
+		except KeyError:
+			#the mock api returns no data
+			pass
+
+		self.assertEqual(self.api.requests, [('get', 'tasks/1', {})])
+
+	def test_prefetch_children(self):
+		projects = [Project({'id': i}) for i in range(1, 6)]
+
+		Entity.prefetch_children(projects, 'tasks', max_workers=3)
+
+		self.assertEqual(
+			sorted(r[1] for r in self.api.requests),
+			['projects/{0}/tasks'.format(i) for i in range(1, 6)]
+		)
+
+		#children are now populated so no further requests are made
+		for project in projects:
+			self.assertEqual(project.tasks, [])
+		self.assertEqual(len(self.api.requests), 5)
+
+		self.assertRaises(entity.EntityException, Entity.prefetch_children, projects, 'foo')
+
+class QueryTest(BaseTest):
+	def test_pushdown(self):
+		query = Query(Task, {
+			'project': Project({'id': 2}),
+			'assignee': 'me',
+			'modified_at': Range(start='2015-01-01'),
+			'name': lambda n: 'a' in n
+		}, fields=['name'])
+
+		self.assertEqual(query.params, {
+			'opt_fields': 'name,modified_at', 'project': 2, 'assignee': 'me',
+			'modified_since': '2015-01-01'
+		})
+		self.assertEqual(sorted(key for key, _ in query.tests), ['modified_at', 'name'])
+
+		explained = Task.explain({'modified_at': Range(start='2015-01-01'), 'completed': False})
+		self.assertIn('server: modified_since=2015-01-01', explained)
+		self.assertIn("client: modified_at Range('2015-01-01', None)", explained)
+		self.assertIn('client: completed False', explained)
+
+	def test_client_filters(self):
+		query = Query(Task, {
+			'completed_at': Range(start='2015-01-01', end='2015-02-01'),
+			'created_by': User({'id': 5}),
+			'completed': True
+		})
+
+		self.assertEqual(query.params['completed_since'], '2015-01-01')
+
+		base = {'name': 'a', 'completed': True, 'created_by': {'id': 5}}
+		matching = dict(base, completed_at='2015-01-10')
+
+		self.assertEqual(
+			Task._build_result(query, [
+				matching,
+				dict(base, completed_at=None),
+				dict(base, completed_at='2015-03-01'),
+				dict(matching, created_by={'id': 6}),
+				dict(matching, completed=False)
+			]),
+			[Task(matching)]
+		)
+
+		self.assertRaises(entity.EntityException, query.matches, {'name': 'a'})
+
+	def test_find_sends_compiled_params(self):
+		Task.find({'project': Project({'id': 1}), 'name': 'x'})
+
+		self.assertEqual(
+			self.api.requests[0][2]['params'],
+			{'project': 1, 'opt_fields': ','.join(Task._fields)}
+		)
+
 class ProjectTest(BaseTest):
 	def test_endpoint_correct(self):
 		self.assertEqual(Project._get_api_endpoint(), 'projects')
@@ -113,6 +312,72 @@ class ProjectTest(BaseTest):
 			self.api.requests
 		)
 
+	def test_sync_tasks(self):
+		api = AsanaAPI('key')
+		api.http_session = SessionMock([
+			ResponseMock({'data': [
+				{'id': 1, 'name': 'a', 'modified_at': '1'},
+				{'id': 2, 'name': 'b', 'modified_at': '1'}
+			]}),
+			ResponseMock({'data': [
+				{'id': 2, 'name': 'b', 'modified_at': '2'},
+				{'id': 3, 'name': 'c', 'modified_at': '2'}
+			]}),
+			ResponseMock({'data': [
+				{'id': 2, 'name': 'b', 'modified_at': '2'},
+				{'id': 3, 'name': 'c', 'modified_at': '2'}
+			]})
+		])
+		Entity.set_api(api)
+
+		project = Project({'id': 5})
+		state = SyncState()
+
+		result = project.sync_tasks(state)
+		self.assertEqual(sorted(result.added), [1, 2])
+		since = state.since
+
+		result = project.sync_tasks(state)
+		self.assertEqual((result.added, result.changed, result.removed), ([3], [2], []))
+		self.assertEqual(api.http_session.requests[1][2]['params']['modified_since'], since)
+		self.assertNotIn('modified_since', api.http_session.requests[0][2]['params'])
+
+		result = project.sync_tasks(state, full=True)
+		self.assertEqual((result.added, result.changed, result.removed), ([], [], [1]))
+		self.assertNotIn('modified_since', api.http_session.requests[2][2]['params'])
+
+		path = temp_path(self, 'syncstate')
+		state.save(path)
+		loaded = SyncState.load(path)
+
+		self.assertEqual(loaded.since, state.since)
+		self.assertEqual(sorted(loaded.tasks), [2, 3])
+		self.assertEqual(loaded.modified, {2: '2', 3: '2'})
+
+	def test_sync_tasks_identity_map(self):
+		"""Changes are found although the map updates the synced Task in place"""
+		api = AsanaAPI('key')
+		api.http_session = SessionMock([
+			ResponseMock({'data': [{'id': 1, 'name': 'a', 'modified_at': '1'}]}),
+			ResponseMock({'data': [{'id': 1, 'name': 'b', 'modified_at': '2'}]})
+		])
+		Entity.set_api(api)
+		Entity.set_identity_map(IdentityMap())
+
+		try:
+			state = SyncState()
+			project = Project({'id': 5})
+
+			project.sync_tasks(state)
+			task = state.tasks[1]
+			result = project.sync_tasks(state)
+		finally:
+			Entity.set_identity_map(None)
+
+		self.assertEqual(result.changed, [1])
+		self.assertIs(state.tasks[1], task)
+		self.assertEqual(task.name, 'b')
+
 class SectionTest(BaseTest):
 	def test_endpoint_correct(self):
 		"""Test section endpoint uses tasks"""
@@ -146,6 +411,114 @@ class SectionTest(BaseTest):
 
 		self.assertNotIn(Task(notinsection), result[0].subtasks)
 
+	def test_iter_streams_sections(self):
+		"""Test each section is yielded as soon as the next header is read"""
+		consumed = []
+
+		def pages():
+			for page in [
+				[{'name': 'one:', 'id': 1}, {'name': 'a', 'id': 2}],
+				[{'name': 'b', 'id': 3}, {'name': 'two:', 'id': 4}],
+				[{'name': 'c', 'id': 5}]
+			]:
+				consumed.append(page)
+				yield page
+
+		sections = Section._iter_result({}, pages())
+
+		first = next(sections)
+		self.assertEqual(len(consumed), 2)
+		self.assertEqual([t.id for t in first.subtasks], [2, 3])
+
+		second = next(sections)
+		self.assertEqual(len(consumed), 3)
+		self.assertEqual([t.id for t in second.subtasks], [5])
+		self.assertRaises(StopIteration, next, sections)
+
+class LayoutPlanTest(BaseTest):
+	@staticmethod
+	def simulate(order, chains):
+		"""Applies chains round robin to order like addProject would"""
+		order = list(order)
+		chains = [list(chain) for chain in chains]
+
+		while any(chains):
+			for chain in chains:
+				if not chain:
+					continue
+
+				move = chain.pop(0)
+
+				if move.task in order:
+					order.remove(move.task)
+
+				if move.insert_after is not None:
+					order.insert(order.index(move.insert_after) + 1, move.task)
+				elif move.insert_before is not None:
+					order.insert(order.index(move.insert_before), move.task)
+				else:
+					order.append(move.task)
+
+		return order
+
+	def test_diff_minimal_moves(self):
+		current = [1, 2, 3, 4, 5, 6, 7, 8, 99]
+		desired = [10, 5, 1, 2, 20, 6, 3, 4, 8, 7]
+
+		chains = LayoutPlan.diff(current, desired)
+		moves = [m.task for chain in chains for m in chain]
+
+		#1 2 3 4 8 stay, the longest run already in order
+		self.assertEqual(len(moves), len(desired) - 5)
+		self.assertEqual(len(chains), 3)
+
+		result = [id for id in self.simulate(current, chains) if id in desired]
+		self.assertEqual(result, desired)
+
+	def test_diff_nothing_in_place(self):
+		chains = LayoutPlan.diff([], [3, 1, 2])
+
+		self.assertEqual(self.simulate([], chains), [3, 1, 2])
+		self.assertEqual(LayoutPlan.diff([1, 2, 3], [1, 2, 3]), [])
+
+	def test_execute_and_resume(self):
+		plan = LayoutPlan(Project({'id': 9}), [
+			(None, [Task({'id': 3})]),
+			(Section({'id': 10}), [1, 2]),
+			(11, [4])
+		], current=[10, 1, 11, 2, 3, 4])
+
+		self.assertEqual([m.task for m in plan.moves], [3, 2])
+		self.assertEqual(plan.moves[0].insert_before, 10)
+
+		calls = []
+
+		def fail_first(target, **kwargs):
+			calls.append((target, kwargs['data']))
+
+			if len(calls) == 1:
+				raise AsanaException('Failed')
+
+		self.api.post = fail_first
+
+		self.assertRaises(AsanaException, plan.execute, max_workers=1)
+		self.assertEqual(list(plan.failed), [3])
+		self.assertEqual(len(plan.pending), 1)
+
+		progress = []
+		plan.execute(progress=lambda done, total: progress.append((done, total)))
+
+		self.assertEqual(progress, [(2, 2)])
+		self.assertEqual(plan.pending, [])
+		self.assertEqual(calls[-1][1]['project'], 9)
+
+		path = temp_path(self, 'layout')
+		plan.save(path)
+		loaded = LayoutPlan.load(path)
+
+		self.assertEqual(loaded.moves, plan.moves)
+		self.assertEqual(loaded.pending, [])
+
 class TaskTest(BaseTest):
 	def test_addremove_project(self):
 		"""Tests adding and removing project
@@ -197,6 +570,718 @@ class TaskTest(BaseTest):
 			self.api.requests
 		)
 
+		task.add_to_section(section, Project({'id': 5}))
+
+		self.assertEqual(
+			self.api.requests[-1],
+			('post', 'tasks/1/addProject', {'data': {'project': 5, 'insert_after': 2}})
+		)
+
+class EntityTableTest(unittest.TestCase):
+	def setUp(self):
+		self.api = AsanaAPI('key')
+		self.api.http_session = SessionMock([
+			ResponseMock({'data': [
+				{'id': 1, 'name': 'a', 'assignee': {'id': 5}, 'extra': 'dropped'},
+				{'id': 2, 'name': 'Section:'},
+				{'id': 3, 'name': 'c', 'followers': [{'id': 6}]}
+			]})
+		])
+		Entity.set_api(self.api)
+
+	def test_find_table(self):
+		table = Task.find_table({'project': 1})
+
+		self.assertEqual(len(table), 2)
+		self.assertEqual(table.column('name'), ['a', 'c'])
+		self.assertEqual(table.columns[0], 'id')
+		self.assertNotIn('extra', table.columns)
+
+		self.assertEqual([row.id for row in table], [1, 3])
+		self.assertEqual(table[-1].name, 'c')
+		self.assertIsNone(table[0].notes)
+		self.assertIsInstance(table[0].assignee, User)
+		self.assertIs(table[0].assignee, table[0].assignee)
+		self.assertIsInstance(table[1].followers[0], User)
+
+		self.assertRaises(AttributeError, getattr, table[0], 'foo')
+		self.assertRaises(IndexError, table.__getitem__, 2)
+
+	def test_rows_expand_to_entities(self):
+		table = Project({'id': 9}).subitem_table(Task)
+
+		self.assertEqual(table[0].to_entity(), Task({'id': 1}))
+		self.assertEqual(table.to_entities()[1].name, 'c')
+		self.assertTrue(self.api.http_session.requests[0][1].endswith('projects/9/tasks'))
+
+class AsanaAPITest(unittest.TestCase):
+	def setUp(self):
+		self.api = AsanaAPI('key')
+		self.session = SessionMock()
+		self.api.http_session = self.session
+
+	def test_pooled_session(self):
+		"""Requests go through one shared session with the configured timeout"""
+		api = AsanaAPI('key', pool_maxsize=4, timeout=5)
+
+		adapter = api.http_session.get_adapter('https://app.asana.com/api')
+		self.assertEqual(adapter._pool_maxsize, 4)
+		self.assertEqual(api.http_session.auth, ('key', ''))
+
+		api.http_session = self.session
+		api.get('tasks/1')
+		api.get('tasks/2')
+
+		self.assertEqual(len(self.session.requests), 2)
+		self.assertEqual(self.session.requests[0][2]['timeout'], 5)
+
+	def test_context_manager_closes(self):
+		with self.api as api:
+			api.get('tasks/1')
+
+		self.assertTrue(self.session.closed)
+
+	def test_get_pages_follows_offset(self):
+		self.session.responses = [
+			ResponseMock({'data': [{'id': 1}], 'next_page': {'offset': 'abc'}}),
+			ResponseMock({'data': [{'id': 2}], 'next_page': None})
+		]
+
+		pages = list(self.api.get_pages('tasks', params={'project': 1}, page_size=1))
+
+		self.assertEqual(pages, [[{'id': 1}], [{'id': 2}]])
+		self.assertEqual(
+			self.session.requests[1][2]['params'],
+			{'project': 1, 'limit': 1, 'offset': 'abc'}
+		)
+
+	def test_find_iter_streams_pages(self):
+		Entity.set_api(self.api)
+		self.session.responses = [
+			ResponseMock({'data': [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b:'}],
+				'next_page': {'offset': 'abc'}}),
+			ResponseMock({'data': [{'id': 3, 'name': 'c'}]})
+		]
+
+		tasks = Project({'id': 5}).iter_tasks({'name': lambda n: n != 'c'})
+
+		self.assertEqual(self.session.requests, [])
+		self.assertEqual([t.id for t in tasks], [1])
+		self.assertEqual(len(self.session.requests), 2)
+		self.assertTrue(self.session.requests[0][1].endswith('projects/5/tasks'))
+
+	def test_custom_decoder(self):
+		decoded = []
+
+		def decoder(content):
+			decoded.append(content)
+			return json.loads(content)
+
+		api = AsanaAPI('key', decoder=decoder)
+		api.http_session = SessionMock([ResponseMock({'data': {'id': 1}})])
+
+		self.assertEqual(api.get('tasks/1'), {'id': 1})
+		self.assertEqual(decoded, ['{"data": {"id": 1}}'])
+
+	@unittest.skipIf(ijson is None, 'ijson is not installed')
+	def test_stream_pages(self):
+		api = AsanaAPI('key', stream_pages=True)
+		first = ResponseMock({
+			'data': [{'id': 1, 'followers': [{'id': 5}]}, {'id': 2}],
+			'next_page': {'offset': 'abc'}
+		})
+		api.http_session = SessionMock([first, ResponseMock({'data': [{'id': 3}], 'next_page': None})])
+
+		pages = api.get_pages('tasks', params={'project': 1})
+		page = next(pages)
+
+		self.assertEqual(next(page), {'id': 1, 'followers': [{'id': 5}]})
+		self.assertFalse(first.closed)
+		self.assertTrue(api.http_session.requests[0][2]['stream'])
+
+		self.assertEqual([list(p) for p in pages], [[{'id': 3}]])
+		self.assertTrue(first.closed)
+		self.assertEqual(api.http_session.requests[1][2]['params']['offset'], 'abc')
+
+	def test_rate_limited_retry_is_bounded(self):
+		sleeps = []
+		sleep, time.sleep = time.sleep, sleeps.append
+
+		try:
+			api = AsanaAPI('key', max_retries=1, retry_jitter=0)
+			api.http_session = self.session
+			limited = ResponseMock(status_code=429, headers={'Retry-After': '2'})
+
+			self.session.responses = [limited, ResponseMock({'data': {'id': 1}})]
+			self.assertEqual(api.get('tasks/1'), {'id': 1})
+			self.assertEqual(sleeps, [2])
+			self.assertEqual(self.session.requests[0][1], self.session.requests[1][1])
+
+			self.session.responses = [limited, limited]
+			self.assertRaises(AsanaException, api.get, 'tasks/1')
+			self.assertEqual(sleeps, [2, 2])
+
+			api.max_retries = 0
+			self.session.responses = [limited]
+			self.assertRaises(AsanaException, api.get, 'tasks/1')
+			self.assertEqual(sleeps, [2, 2])
+		finally:
+			time.sleep = sleep
+
+	def test_batch_groups_in_order(self):
+		Entity.set_api(self.api)
+		self.session.responses = [
+			ResponseMock({'data': [
+				{'status_code': 200, 'body': {'data': {'id': 10}}},
+				{'status_code': 200, 'body': {'data': {}}}
+			]}),
+			ResponseMock({'data': [
+				{'status_code': 400, 'body': {'errors': []}}
+			]})
+		]
+
+		task = Task({'name': 'new'})
+
+		with self.api.batch(size=2) as batch:
+			task.save()
+			added = Task({'id': 1}).add_project(2)
+			removed = self.api.delete('tasks/3')
+
+			self.assertEqual(self.session.requests, [])
+			self.assertFalse(added.done())
+
+		self.assertEqual(len(self.session.requests), 2)
+
+		actions = [
+			json.loads(r[2]['data'])['data']['actions'] for r in self.session.requests
+		]
+		self.assertTrue(self.session.requests[0][1].endswith('/batch'))
+		self.assertEqual(actions, [
+			[
+				{'method': 'post', 'relative_path': '/tasks', 'data': {'name': 'new'}},
+				{'method': 'post', 'relative_path': '/tasks/1/addProject', 'data': {'project': 2}}
+			],
+			[{'method': 'delete', 'relative_path': '/tasks/3'}]
+		])
+
+		self.assertEqual(task.id, 10)
+		self.assertEqual(added.result(), {})
+		self.assertRaises(AsanaException, removed.result)
+
+	def test_batch_barrier(self):
+		Entity.set_api(self.api)
+
+		with self.api.batch() as batch:
+			Task({'id': 1}).add_project(2)
+			batch.barrier()
+			Task({'id': 1}).add_project(3)
+
+		self.assertEqual(len(self.session.requests), 2)
+		self.assertEqual(
+			[json.loads(r[2]['data'])['data']['actions'][0]['data'] for r in self.session.requests],
+			[{'project': 2}, {'project': 3}]
+		)
+
+	def test_session_coalesces_updates(self):
+		Entity.set_api(self.api)
+		self.session.responses = [
+			ResponseMock({'data': {'id': 1}}),
+			ResponseMock({'errors': [{'message': 'no'}]}, status_code=400)
+		]
+
+		task = Task({'id': 1, 'name': 'a', 'notes': 'n'})
+		other = Task({'id': 2, 'name': 'b'})
+		unchanged = Task({'id': 3, 'name': 'c'})
+
+		with self.api.session(max_workers=1) as s:
+			task.name = 'x'
+			first = task.save()
+			task.notes = 'y'
+			task.save()
+			other.name = 'z'
+			other.save()
+			unchanged.name = 'c'
+			self.assertIsNone(unchanged.save())
+
+			self.assertEqual(self.session.requests, [])
+
+		self.assertEqual(len(self.session.requests), 2)
+		self.assertEqual(json.loads(self.session.requests[0][2]['data']),
+			{'data': {'name': 'x', 'notes': 'y'}})
+		self.assertEqual(first.result(), {'id': 1})
+
+		self.assertEqual(s.succeeded, ['tasks/1'])
+		self.assertEqual(list(s.failed), ['tasks/2'])
+		self.assertEqual(task._dirty, set())
+		self.assertEqual(other._dirty, set(['name']))
+		self.assertEqual(unchanged._dirty, set())
+
+	def test_session_batched(self):
+		Entity.set_api(self.api)
+		self.session.responses = [ResponseMock({'data': [
+			{'status_code': 200, 'body': {'data': {'id': 1}}},
+			{'status_code': 200, 'body': {'data': {'id': 2}}}
+		]})]
+
+		with self.api.session(batch=True) as s:
+			for id in (1, 2, 1):
+				task = Task({'id': id})
+				task.completed = True
+				task.save()
+
+		self.assertEqual(len(self.session.requests), 1)
+		self.assertEqual(
+			[a['relative_path'] for a in json.loads(self.session.requests[0][2]['data'])['data']['actions']],
+			['/tasks/1', '/tasks/2']
+		)
+		self.assertEqual(s.succeeded, ['tasks/1', 'tasks/2'])
+
+	def _coalesced(self, fn, count, responses):
+		"""Runs fn on count threads while the session holds back responses
+		until every thread but the one sending has joined the request
+
+		:returns: list of what each call returned or raised
+		"""
+		release = threading.Event()
+		waiting = []
+		results = []
+
+		class SlowSession(SessionMock):
+			def request(self, method, url, **kwargs):
+				release.wait(5)
+				return SessionMock.request(self, method, url, **kwargs)
+
+		self.api.http_session = SlowSession(responses)
+		hook = lambda e: e['cache'] == 'coalesced' and waiting.append(e)
+		self.api.add_hook('before', hook)
+
+		def run():
+			try:
+				results.append(fn())
+			except AsanaException as e:
+				results.append(e)
+
+		threads = [threading.Thread(target=run) for _ in range(count)]
+
+		for thread in threads:
+			thread.start()
+
+		while len(waiting) < count - 1:
+			time.sleep(0.001)
+
+		release.set()
+
+		for thread in threads:
+			thread.join()
+
+		self.api.remove_hook('before', hook)
+
+		return results
+
+	def test_single_flight(self):
+		"""Identical concurrent GETs share one request"""
+		get = lambda: self.api.get('workspaces/1', params={'opt_fields': 'name'})
+
+		results = self._coalesced(get, 4, [ResponseMock({'data': {'id': 1}})])
+		self.assertEqual(results, [{'id': 1}] * 4)
+		self.assertEqual(len(self.api.http_session.requests), 1)
+
+		results = self._coalesced(get, 4, [
+			ResponseMock({'errors': [{'message': 'gone'}]}, status_code=404)])
+		self.assertTrue(all(isinstance(r, AsanaException) for r in results))
+		self.assertEqual(len(self.api.http_session.requests), 1)
+
+		self.assertEqual(self.api._inflight, {})
+
+	def test_single_flight_copies(self):
+		"""Callers sharing a request don't share the entities' data"""
+		Entity.set_api(self.api)
+
+		first, second = self._coalesced(lambda: Task.find({'project': 5}), 2, [
+			ResponseMock({'data': [{'id': 1, 'name': 'a', 'assignee': {'id': 2}}]})])
+
+		first[0].name = 'changed locally'
+		first[0].assignee._data['name'] = 'changed locally'
+
+		self.assertEqual(second[0].name, 'a')
+		self.assertEqual(second[0]._dirty, set())
+		self.assertNotIn('name', second[0].assignee._data)
+
+	def test_request_hooks(self):
+		before, after = [], []
+		api = AsanaAPI('key', cache=True)
+		api.http_session = SessionMock([ResponseMock({'data': {'id': 1}})])
+		api.add_hook('before', before.append)
+		api.add_hook('after', after.append)
+
+		api.get('tasks/12/stories')
+		api.get('tasks/12/stories')
+
+		self.assertEqual(len(before), 2)
+		self.assertEqual(
+			[(e['endpoint'], e['status'], e['cache']) for e in after],
+			[('tasks/{id}/stories', 200, 'miss'), ('tasks/{id}/stories', None, 'hit')]
+		)
+		self.assertEqual(after[0]['bytes'], len('{"data": {"id": 1}}'))
+
+		api.http_session.responses = [ResponseMock(status_code=500)]
+		self.assertRaises(AsanaException, api.put, 'users/me', data={})
+		self.assertEqual((after[-1]['endpoint'], after[-1]['status']), ('users/{id}', 500))
+		self.assertIsInstance(after[-1]['error'], AsanaException)
+
+		self.assertRaises(AsanaException, api.add_hook, 'during', after.append)
+
+class RequestStatsTest(unittest.TestCase):
+	def event(self, endpoint, latency, **kwargs):
+		event = AsanaAPI._new_event('get', endpoint)
+		event.update(latency=latency, **kwargs)
+		return event
+
+	def test_report(self):
+		stats = RequestStats()
+
+		for i in range(1, 101):
+			stats(self.event('tasks/1', i / 1000.0, retries=1 if i == 1 else 0))
+		stats(self.event('users/me', 0.5, cache='hit'))
+
+		report = stats.report()
+
+		self.assertEqual([(r['endpoint'], r['count']) for r in report],
+			[('tasks/{id}', 100), ('users/{id}', 1)])
+		self.assertEqual((report[0]['p50'], report[0]['p95'], report[0]['p99']),
+			(0.05, 0.095, 0.099))
+		self.assertEqual(report[0]['retries'], 1)
+		self.assertEqual(report[1]['cache_hits'], 1)
+
+		out = BytesIO()
+		stats.dump(out)
+		self.assertIn('tasks/{id}', out.getvalue())
+
+	def test_sampling_is_bounded(self):
+		stats = RequestStats(max_samples=10)
+
+		for i in range(100):
+			stats(self.event('tasks', i))
+
+		self.assertEqual(len(stats._stats[('GET', 'tasks')]['latencies']), 10)
+		self.assertEqual(stats.report()[0]['count'], 100)
+
+class RateLimiterTest(unittest.TestCase):
+	def test_burst_then_wait(self):
+		limiter = RateLimiter(60, burst=2)
+
+		self.assertEqual(limiter._update(take=True), 0)
+		self.assertEqual(limiter._update(take=True), 0)
+		self.assertAlmostEqual(limiter._update(take=True), 1, places=1)
+
+	def test_pause_holds_back_callers(self):
+		limiter = RateLimiter(600)
+		limiter.pause(5)
+
+		self.assertTrue(limiter._update(take=True) > 4.9)
+
+	def test_shared_file_backend(self):
+		path = temp_path(self, 'ratelimit')
+		first = RateLimiter(60, burst=1, path=path)
+		second = RateLimiter(60, burst=1, path=path)
+
+		self.assertEqual(first._update(take=True), 0)
+		self.assertTrue(second._update(take=True) > 0)
+
+class CacheTest(unittest.TestCase):
+	def test_lru_eviction(self):
+		cache = Cache(max_entries=2)
+
+		cache.store(1, 'a')
+		cache.store(2, 'b')
+		self.assertTrue(cache.has('a'))
+		cache.store(3, 'c')
+
+		self.assertTrue(cache.has('a'))
+		self.assertFalse(cache.has('b'))
+		self.assertEqual(cache.stats()['evictions'], 1)
+
+	def test_lookup_after_eviction(self):
+		"""Entries removed by another thread read as a miss"""
+		cache = Cache(max_entries=1)
+
+		cache.store(1, 'a')
+		self.assertTrue(cache.has('a'))
+		cache.store(2, 'b')
+
+		self.assertIs(cache.lookup('a'), Cache.MISS)
+		self.assertIsNone(cache.get('a'))
+		self.assertEqual(cache.lookup('b'), 2)
+
+		#the api reads in one step, never has() then get()
+		def race(target, **kwargs):
+			raise AssertionError('has/get called separately')
+
+		cache.has = cache.get = race
+
+		api = AsanaAPI('key', cache=cache)
+		api.http_session = SessionMock([ResponseMock({'data': {'id': 3}})])
+
+		self.assertEqual(api.get('b'), 2)
+		self.assertEqual(api.get('a'), {'id': 3})
+
+	def test_max_bytes(self):
+		cache = Cache(max_bytes=20)
+
+		cache.store('x' * 10, 'a')
+		cache.store('y' * 10, 'b')
+
+		self.assertFalse(cache.has('a'))
+		self.assertTrue(cache.has('b'))
+		self.assertEqual(cache.stats()['bytes'], 12)
+
+	def test_sweep_expired(self):
+		cache = Cache(10, sweep_interval=2)
+
+		cache.store(1, 'a')
+		cache._cache['a']['createTime'] -= 20
+		cache.store(2, 'b')
+
+		self.assertEqual(cache.stats()['entries'], 1)
+		self.assertEqual(cache.stats()['expirations'], 1)
+
+	def test_api_counters(self):
+		api = AsanaAPI('key', cache=True)
+		api.http_session = SessionMock()
+
+		api.get('tasks/1')
+		api.get('tasks/1')
+
+		self.assertEqual(api.cache.cachetime, 0)
+		self.assertEqual(api.cache_stats()['hits'], 1)
+		self.assertEqual(api.cache_stats()['misses'], 1)
+
+	def test_mutations_invalidate(self):
+		api = AsanaAPI('key', cache=True)
+		api.http_session = SessionMock()
+
+		for target in ['tasks/1', 'tasks/1/tags', 'tasks/2', 'projects/3/tasks',
+				'projects/3', 'tasks']:
+			api.get(target, params={'opt_fields': 'name'})
+
+		api.post('tasks/1/addProject', data={'project': 3})
+
+		self.assertEqual(
+			sorted(i['target'] for i in api.cache._cache.values()),
+			['projects/3', 'tasks/2']
+		)
+
+		api.http_session.responses = [ResponseMock({'data': {'id': 2, 'name': 'new'}})]
+		api.put('tasks/2', data={'name': 'new'})
+
+		self.assertTrue(api.cache.has('tasks/2'))
+		self.assertFalse(api.cache.has('tasks/2', params={'opt_fields': 'name'}))
+
+	def test_hits_are_copies(self):
+		"""Local edits to entities built from a response don't reach the cache"""
+		api = AsanaAPI('key', cache=True)
+		api.http_session = SessionMock([
+			ResponseMock({'data': [{'id': 1, 'name': 'a', 'assignee': {'id': 2}}]})])
+		Entity.set_api(api)
+
+		first = Task.find({'project': 5})[0]
+		first.name = 'local edit'
+		first.assignee
+
+		second = Task.find({'project': 5})[0]
+
+		self.assertEqual(len(api.http_session.requests), 1)
+		self.assertIsNot(second._data, first._data)
+		self.assertEqual(second.name, 'a')
+		self.assertEqual([i['value'] for i in api.cache._cache.values()],
+			[[{'id': 1, 'name': 'a', 'assignee': {'id': 2}}]])
+
+class SqliteCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.path = temp_path(self, 'cache.sqlite')
+		self.cache = SqliteCache(self.path, ttls={'users': 100, 'tasks': 10})
+
+	def test_shared_between_instances(self):
+		self.cache.store({'id': 1}, 'tasks/1', params={'opt_fields': 'name'})
+
+		other = SqliteCache(self.path)
+
+		self.assertTrue(other.has('tasks/1', params={'opt_fields': 'name'}))
+		self.assertEqual(other.get('tasks/1', params={'opt_fields': 'name'}), {'id': 1})
+		self.assertFalse(other.has('tasks/1'))
+
+	def test_lookup_after_invalidation(self):
+		"""A row deleted by another process reads as a miss, not as None"""
+		self.cache.store({'id': 1}, 'tasks/1')
+		self.assertEqual(self.cache.lookup('tasks/1'), {'id': 1})
+
+		SqliteCache(self.path).invalidate_collections('tasks')
+		SqliteCache(self.path).invalidate('tasks/1')
+
+		self.assertIs(self.cache.lookup('tasks/1'), SqliteCache.MISS)
+
+		api = AsanaAPI('key', cache=self.cache)
+		api.http_session = SessionMock([ResponseMock({'data': {'id': 1, 'name': 'a'}})])
+
+		self.assertEqual(api.get('tasks/1'), {'id': 1, 'name': 'a'})
+
+	def test_ttl_per_resource(self):
+		self.assertEqual(self.cache._ttl_for('users/me'), 100)
+		self.assertEqual(self.cache._ttl_for('projects/2/tasks'), 10)
+		self.assertEqual(self.cache._ttl_for('projects/2'), 0)
+
+	def test_expired_rows_are_removed(self):
+		self.cache.store({'id': 1}, 'tasks/1')
+		self.cache._connect().execute('UPDATE responses SET expires = 1')
+
+		self.assertFalse(self.cache.has('tasks/1'))
+		self.assertFalse(self.cache.has('tasks/1'))
+		self.assertEqual(self.cache.stats()['entries'], 0)
+		self.assertEqual(self.cache.stats()['expirations'], 1)
+
+		cache = SqliteCache(self.path, ttls={'tasks': 10}, sweep_interval=2)
+		cache.store({'id': 1}, 'tasks/1')
+		cache._connect().execute('UPDATE responses SET expires = 1')
+		cache.store({'id': 2}, 'tasks/2')
+
+		self.assertEqual(cache.stats()['entries'], 1)
+		self.assertEqual(cache.stats()['expirations'], 1)
+
+	def test_invalidate(self):
+		for target in ['tasks/1', 'tasks/1/tags', 'tasks/10', 'projects/3/tasks']:
+			self.cache.store({}, target)
+
+		self.cache.invalidate('tasks/1')
+		self.cache.invalidate_collections('tasks')
+
+		self.assertEqual(
+			[r[0] for r in self.cache._connect().execute('SELECT target FROM responses')],
+			['tasks/10']
+		)
+
+	def test_api_backend(self):
+		api = AsanaAPI('key', cache=self.cache)
+		api.http_session = SessionMock([ResponseMock({'data': {'id': 1}})])
+
+		api.get('users/me')
+
+		self.assertEqual(AsanaAPI('key', cache=SqliteCache(self.path)).get('users/me'), {'id': 1})
+
+class TaskStoreTest(unittest.TestCase):
+	tasks = [
+		{'id': 1, 'name': 'a', 'assignee': {'id': 10}, 'created_by': {'id': 20},
+			'completed': False, 'modified_at': '2015-01-01', 'projects': [{'id': 5}]},
+		{'id': 2, 'name': 'b', 'assignee': {'id': 10}, 'created_by': {'id': 21},
+			'completed': True, 'modified_at': '2015-01-03', 'projects': [{'id': 5}, {'id': 6}]},
+		{'id': 3, 'name': 'c', 'assignee': None, 'created_by': {'id': 20},
+			'completed': False, 'modified_at': '2015-01-02', 'projects': [{'id': 6}]},
+	]
+
+	def setUp(self):
+		Entity.set_api(ApiMock())
+		self.store = self.make_store()
+		self.store.add(json.loads(json.dumps(self.tasks)))
+
+	def make_store(self):
+		return TaskStore()
+
+	def ids(self, query=None):
+		return [t.id for t in self.store.find(query)]
+
+	def test_find(self):
+		self.assertEqual(self.ids(), [1, 2, 3])
+		self.assertEqual(self.ids({'assignee': 10, 'completed': False}), [1])
+		self.assertEqual(self.ids({'assignee': None}), [3])
+		self.assertEqual(self.ids({'project': [6, 7], 'created_by': User({'id': 20})}), [3])
+		self.assertEqual(self.ids({'modified_at': Range('2015-01-02')}), [2, 3])
+		self.assertEqual(self.ids({'modified_at': Range(end='2015-01-02')}), [1, 3])
+		self.assertEqual(self.store.get(2).name, 'b')
+		self.assertEqual(len(self.store), 3)
+
+		self.assertRaises(entity.EntityException, self.store.find, {'name': 'a'})
+
+	def test_replace_and_remove(self):
+		task = self.store.get(1)
+		task._data['assignee'] = {'id': 11}
+		task._data['projects'] = [{'id': 6}]
+		self.store.add([task])
+
+		self.assertEqual(self.ids({'assignee': 10}), [2])
+		self.assertEqual(self.ids({'assignee': 11}), [1])
+		self.assertEqual(self.ids({'project': 5}), [2])
+
+		self.store.remove([2, 99])
+
+		self.assertEqual(self.ids({'project': 6}), [1, 3])
+		self.assertEqual(self.ids({'modified_at': Range('2015-01-01')}), [1, 3])
+		self.assertNotIn(2, self.store)
+
+	def test_group_by(self):
+		groups = self.store.group_by('project', {'completed': False})
+
+		self.assertEqual(sorted(groups), [5, 6])
+		self.assertEqual([t.id for t in groups[5]], [1])
+		self.assertEqual([t.id for t in self.store.group_by('created_by')[20]], [1, 3])
+
+	def test_apply_sync(self):
+		state = SyncState(tasks={
+			3: Task({'id': 3, 'assignee': {'id': 12}, 'modified_at': '2015-02-01'}),
+			4: Task({'id': 4, 'assignee': {'id': 12}, 'modified_at': '2015-02-01'})
+		})
+		result = SyncResult()
+		result.added, result.changed, result.removed = [4], [3], [1]
+
+		self.store.apply_sync(state, result)
+
+		self.assertEqual(self.ids(), [2, 3, 4])
+		self.assertEqual(self.ids({'assignee': 12}), [3, 4])
+
+class SqliteTaskStoreTest(TaskStoreTest):
+	def make_store(self):
+		self.path = temp_path(self, 'store.sqlite')
+
+		return SqliteTaskStore(self.path)
+
+	def test_shared_between_instances(self):
+		other = SqliteTaskStore(self.path)
+
+		self.assertEqual([t.id for t in other.find({'project': 6})], [2, 3])
+
+class AsyncAsanaAPITest(unittest.TestCase):
+	def setUp(self):
+		self.api = AsyncAsanaAPI('key', max_workers=2)
+		self.session = SessionMock()
+		self.api.http_session = self.session
+		Entity.set_api(self.api)
+
+	def tearDown(self):
+		self.api.close()
+
+	def test_requests_return_futures(self):
+		self.session.responses = [ResponseMock({'data': {'id': 1}})]
+
+		self.assertEqual(self.api.aget('tasks/1').result(1), {'id': 1})
+
+	def test_entity_operations(self):
+		self.session.responses = [
+			ResponseMock({'data': [{'id': 1, 'name': 'a'}]}),
+			ResponseMock({'data': {'id': 1, 'notes': 'loaded'}})
+		]
+
+		tasks = Task.afind({'project': 2}).result(1)
+		self.assertEqual(tasks, [Task({'id': 1})])
+
+		self.assertEqual(tasks[0].aload().result(1).notes, 'loaded')
+
+		tasks[0].name = 'b'
+		tasks[0].asave().result(1)
+		self.assertEqual(self.session.requests[-1][0], 'put')
+
+	def test_requires_async_api(self):
+		Entity.set_api(AsanaAPI('key'))
+
+		self.assertRaises(entity.EntityException, Task.afind)
+
 
 if __name__ == "__main__":
 	unittest.main()
\ No newline at end of file